@@ -0,0 +1,150 @@
+import hashlib
+import os
+import struct
+
+from Crypto.Cipher import AES
+
+WIDEVINE_SYSTEM_ID = bytes.fromhex('edef8ba979d64acea3c827dcd51d21ed')
+PLAYREADY_SYSTEM_ID = bytes.fromhex('9a04f07998404286ab92e65be0885f95')
+KID = bytes.fromhex('00112233445566778899aabbccddeeff')
+KEY = bytes.fromhex('0123456789abcdef0123456789abcdef')
+CBCS_IV = bytes.fromhex('0f0e0d0c0b0a09080706050403020100')
+CBCS_PATTERN = 1, 9
+CLEAR_BYTES = 32
+
+
+def box(box_type, *payload):
+    payload = b''.join(payload)
+    return struct.pack('>I4s', 8 + len(payload), box_type) + payload
+
+
+def full_box(box_type, version, flags, *payload):
+    return box(box_type, struct.pack('>I', version << 24 | flags), *payload)
+
+
+def pssh(system_id, data=b'\x12\x10' + KID):
+    return full_box(b'pssh', 0, 0, system_id, struct.pack('>I', len(data)), data)
+
+
+def tenc(scheme=b'cenc', kid=KID):
+    if scheme == b'cbcs':
+        crypt, skip = CBCS_PATTERN
+        return full_box(b'tenc', 1, 0, bytes((0, crypt << 4 | skip, 1, 0)), kid, bytes((len(CBCS_IV),)), CBCS_IV)
+
+    return full_box(b'tenc', 0, 0, b'\0\0\x01\x08', kid)
+
+
+def moov(system_ids=(WIDEVINE_SYSTEM_ID,), kid=KID, scheme=b'cenc'):
+    sinf = box(
+        b'sinf', box(b'frma', b'avc1'), full_box(b'schm', 0, 0, scheme, struct.pack('>I', 0x10000)),
+        box(b'schi', tenc(scheme, kid)))
+    entry = box(b'encv', bytes(6), b'\0\x01', bytes(70), box(b'avcC', bytes(10)), sinf)
+    trak = box(
+        b'trak', full_box(b'tkhd', 0, 3, bytes(8), struct.pack('>I', 1), bytes(68)),
+        box(b'mdia', full_box(b'hdlr', 0, 0, bytes(4), b'vide', bytes(13)),
+            box(b'minf', box(b'stbl', full_box(b'stsd', 0, 0, struct.pack('>I', 1), entry)))))
+    mvex = box(b'mvex', full_box(b'trex', 0, 0, struct.pack('>5I', 1, 1, 0, 0, 0)))
+
+    return box(
+        b'moov', full_box(b'mvhd', 0, 0, bytes(96)), trak, mvex,
+        *(pssh(system_id) for system_id in system_ids))
+
+
+def init_segment(**kwargs):
+    return box(b'ftyp', b'isom', bytes(4)) + moov(**kwargs)
+
+
+def media_file(size, moov_at_end=False, **kwargs):
+    """Return an MP4 file of roughly `size` bytes with a single random mdat"""
+    header = box(b'ftyp', b'isom', bytes(4))
+    mdat = box(b'mdat', os.urandom(max(size - 1024, 0)))
+
+    if moov_at_end:
+        return header + mdat + moov(**kwargs)
+
+    return header + moov(**kwargs) + mdat
+
+
+def _encrypt(data, scheme, iv):
+    if scheme == b'cenc':
+        return AES.new(KEY, AES.MODE_CTR, nonce=b'', initial_value=iv.ljust(16, b'\0')).encrypt(data)
+
+    # cbcs encrypts the first `crypt` of every `crypt + skip` blocks, chaining over the encrypted ones
+    crypt, skip = CBCS_PATTERN
+    cipher, data = AES.new(KEY, AES.MODE_CBC, iv=iv), bytearray(data)
+
+    for start in range(0, len(data) // 16 * 16, 16 * (crypt + skip)):
+        end = min(start + 16 * crypt, len(data) // 16 * 16)
+        data[start:end] = cipher.encrypt(bytes(data[start:end]))
+
+    return bytes(data)
+
+
+def _subsamples(sample_size, subsamples):
+    """Split a sample into (clear, protected) sizes"""
+    sizes = [sample_size // subsamples] * subsamples
+    sizes[-1] += sample_size % subsamples
+    return [(min(CLEAR_BYTES, size), size - min(CLEAR_BYTES, size)) for size in sizes]
+
+
+def fragment(sequence, samples, scheme=b'cenc', subsamples=1):
+    """Return a moof and mdat with the samples encrypted; subsamples=0 encrypts whole samples"""
+    iv_size = 0 if scheme == b'cbcs' else 8
+    encrypted, aux_info = [], []
+
+    for sample in samples:
+        iv = CBCS_IV if scheme == b'cbcs' else os.urandom(iv_size)
+        info = iv[:iv_size]
+
+        if not subsamples:
+            encrypted.append(_encrypt(sample, scheme, iv))
+            aux_info.append(info)
+            continue
+
+        pos, layout, out = 0, _subsamples(len(sample), subsamples), []
+        ctr = AES.new(KEY, AES.MODE_CTR, nonce=b'', initial_value=iv.ljust(16, b'\0')) if scheme == b'cenc' else None
+
+        for clear_size, protected_size in layout:
+            protected = sample[pos + clear_size:pos + clear_size + protected_size]
+            out += (sample[pos:pos + clear_size], ctr.encrypt(protected) if ctr else _encrypt(protected, scheme, iv))
+            pos += clear_size + protected_size
+
+        encrypted.append(b''.join(out))
+        aux_info.append(info + struct.pack('>H', len(layout)) + b''.join(struct.pack('>HI', *sizes) for sizes in layout))
+
+    senc = full_box(b'senc', 0, 0x2 if subsamples else 0, struct.pack('>I', len(samples)), *aux_info)
+    saiz = full_box(b'saiz', 0, 0, b'\0', struct.pack('>I', len(samples)), bytes(len(info) for info in aux_info))
+
+    def build(data_offset):
+        mfhd = full_box(b'mfhd', 0, 0, struct.pack('>I', sequence))
+        tfhd = full_box(b'tfhd', 0, 0x20000, struct.pack('>I', 1))
+        trun = full_box(
+            b'trun', 0, 0x201, struct.pack('>Ii', len(samples), data_offset),
+            *(struct.pack('>I', len(sample)) for sample in samples))
+        # the auxiliary information starts after the header and sample count of senc
+        aux_offset = 8 + len(mfhd) + 8 + len(tfhd) + len(trun) + len(saiz) + 20 + 16
+        saio = full_box(b'saio', 0, 0, struct.pack('>II', 1, aux_offset))
+        return box(b'moof', mfhd, box(b'traf', tfhd, trun, saiz, saio, senc))
+
+    moof = build(0)
+    return build(len(moof) + 8) + box(b'mdat', *encrypted)
+
+
+def encrypted_file(path, size, fragments=64, samples=48, subsamples=1, scheme=b'cenc'):
+    """Write a fragmented MP4 file of roughly `size` bytes encrypted with KEY, one fragment at a time
+
+    Returns the SHA-256 hex digest of the clear samples in order.
+    """
+    sample_size = max(size // max(fragments * samples, 1), CLEAR_BYTES * max(subsamples, 1) + 16)
+    digest = hashlib.sha256()
+
+    with open(path, 'wb') as f:
+        f.write(init_segment(scheme=scheme))
+
+        for sequence in range(1, fragments + 1):
+            clear = [os.urandom(sample_size) for _ in range(samples)]
+            for sample in clear:
+                digest.update(sample)
+            f.write(fragment(sequence, clear, scheme, subsamples))
+
+    return digest.hexdigest()
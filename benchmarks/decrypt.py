@@ -0,0 +1,303 @@
+"""Measure the decryption engines and the PSSH probe on synthetic encrypted files
+
+Each case runs in a separate process and reports its best time, its peak RSS (including
+child processes such as mp4decrypt) and the bytes it wrote to disk. With --baseline, the
+results are compared to a previous --save-baseline run and the exit status is 1 on regressions
+beyond --tolerance; slowdowns below --min-delta are ignored. The output of the first run of
+each engine is compared to the clear samples, and a mismatch also makes the exit status 1.
+
+Usage: python -m benchmarks.decrypt [--size MB] [--engines ...] [--baseline FILE] [--save-baseline FILE]
+"""
+import argparse
+import contextlib
+import hashlib
+import http.server
+import json
+import os
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from ._mp4gen import KEY, KID, encrypted_file
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+ENGINES = ('mp4decrypt', 'native', 'parallel', 'inplace', 'pssh')
+SCHEMES = ('cenc', 'cbcs')
+KEY_ARGS = ('--key', f'{KID.hex()}:{KEY.hex()}')
+MISMATCH = 'Decrypted samples do not match the clear samples'
+
+
+def _peak_rss():
+    if not resource:
+        return None
+
+    peak = max(resource.getrusage(who).ru_maxrss for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN))
+    # kilobytes everywhere but on macOS
+    return peak if sys.platform == 'darwin' else peak << 10
+
+
+def _bytes_written():
+    # includes the children which have been waited for
+    with contextlib.suppress(OSError), open('/proc/self/io') as f:
+        return next(int(line.split()[1]) for line in f if line.startswith('write_bytes:'))
+
+    return None
+
+
+class _RangeHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        path = os.path.join(self.server.directory, os.path.basename(self.path))
+        start = int(self.headers.get('Range', 'bytes=0-')[6:].partition('-')[0] or 0)
+
+        with open(path, 'rb') as f:
+            size = f.seek(0, 2)
+            f.seek(start)
+            self.send_response(206 if start else 200)
+            self.send_header('Content-Length', str(size - start))
+            self.end_headers()
+
+            with contextlib.suppress(ConnectionError):
+                shutil.copyfileobj(f, self.wfile)
+
+    def log_message(self, *args):
+        pass
+
+
+def _run_pssh(filepath, repeat):
+    from yt_dlp import YoutubeDL
+
+    from yt_dlp_plugins.postprocessor.mp4decrypt import Mp4DecryptPP
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), _RangeHandler)
+    server.daemon_threads = True
+    server.directory = os.path.dirname(filepath)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    pp = Mp4DecryptPP(YoutubeDL({'quiet': True, 'noprogress': True}))
+    part = {'format_id': 'bench', 'url': f'http://127.0.0.1:{server.server_port}/{os.path.basename(filepath)}'}
+    best = float('inf')
+
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            if not pp._pssh_from_init(part):
+                raise RuntimeError('No PSSH found')
+            best = min(best, time.perf_counter() - start)
+    finally:
+        server.shutdown()
+
+    return best
+
+
+def _payload_digest(filepath):
+    """Return the SHA-256 hex digest of the mdat payloads, which hold the samples in order"""
+    digest = hashlib.sha256()
+
+    with open(filepath, 'rb') as f:
+        while len(header := f.read(8)) == 8:
+            size, box_type = struct.unpack('>I4s', header)
+
+            if size == 1:
+                size = struct.unpack('>Q', f.read(8))[0] - 16
+            elif size == 0:
+                size = os.fstat(f.fileno()).st_size - f.tell()
+            else:
+                size -= 8
+
+            if box_type != b'mdat':
+                f.seek(size, 1)
+                continue
+
+            while size > 0 and (chunk := f.read(min(size, 1 << 20))):
+                digest.update(chunk)
+                size -= len(chunk)
+
+    return digest.hexdigest()
+
+
+def _run_decrypt(engine, filepath, repeat, processes, payload_sha256=None):
+    from yt_dlp import YoutubeDL
+
+    from yt_dlp_plugins.postprocessor._cenc import UnsupportedError
+    from yt_dlp_plugins.postprocessor.mp4decrypt import Mp4DecryptDecryptor
+
+    decryptor = Mp4DecryptDecryptor(YoutubeDL({'quiet': True}), processes=processes if engine == 'parallel' else 1)
+    tmppath = filepath + '.out'
+    best = float('inf')
+
+    for i in range(repeat):
+        if engine == 'inplace':
+            shutil.copyfile(filepath, tmppath)
+
+        written_before = _bytes_written()
+        start = time.perf_counter()
+
+        try:
+            if engine == 'mp4decrypt':
+                decryptor._run_mp4decrypt(filepath, tmppath, KEY_ARGS)
+            elif engine == 'inplace':
+                if not decryptor._decrypt_inplace(tmppath, KEY_ARGS):
+                    raise UnsupportedError('Not supported in place')
+            else:
+                decryptor._run_native(filepath, tmppath, KEY_ARGS)
+        except UnsupportedError as e:
+            return {'error': str(e)}
+
+        best = min(best, time.perf_counter() - start)
+        written = None if written_before is None else _bytes_written() - written_before
+
+        # a fast engine is only worth measuring if its output is right
+        if not i and payload_sha256 and _payload_digest(tmppath) != payload_sha256:
+            os.remove(tmppath)
+            return {'error': MISMATCH}
+
+        if os.path.exists(tmppath):
+            os.remove(tmppath)
+
+    return {'seconds': best, 'bytes_written': written}
+
+
+def worker(engine, filepath, repeat, processes, payload_sha256=None):
+    if engine == 'pssh':
+        # a probe only takes milliseconds
+        result = {'seconds': _run_pssh(filepath, repeat * 20)}
+    else:
+        result = _run_decrypt(engine, filepath, repeat, processes, payload_sha256)
+
+    result['peak_rss'] = _peak_rss()
+    print(json.dumps(result))
+
+
+def run_case(engine, filepath, repeat, processes, payload_sha256=None):
+    if engine == 'mp4decrypt' and not shutil.which('mp4decrypt'):
+        return {'error': 'mp4decrypt is not installed'}
+
+    proc = subprocess.run(
+        [sys.executable, '-m', 'benchmarks.decrypt', '--worker', engine, filepath,
+         '--repeat', str(repeat), '--processes', str(processes)]
+        + (['--payload-sha256', payload_sha256] if payload_sha256 else []),
+        capture_output=True, text=True)
+
+    if proc.returncode:
+        return {'error': proc.stderr.strip().splitlines()[-1]}
+
+    return json.loads(proc.stdout.splitlines()[-1])
+
+
+def compare(results, baseline, tolerance, min_delta=0.005):
+    """Return the descriptions of the results which are worse than the baseline
+
+    Timings which are slower by less than min_delta seconds are ignored, as a relative tolerance
+    is within the noise for cases which only take milliseconds.
+    """
+    regressions = []
+
+    for name, result in results.items():
+        if not (base := baseline.get(name)) or 'error' in result or 'error' in base:
+            continue
+
+        for key in ('seconds', 'peak_rss', 'bytes_written'):
+            if not (result.get(key) and base.get(key)) or result[key] <= base[key] * (1 + tolerance):
+                continue
+            if key == 'seconds' and result[key] - base[key] < min_delta:
+                continue
+
+            regressions.append(f'{name}: {key} {base[key]:.4g} -> {result[key]:.4g}')
+
+    return regressions
+
+
+def _format(value, scale, unit):
+    return '-' if value is None else f'{value / scale:.1f}{unit}'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size', type=int, default=256, help='size of the files in MB (default: 256)')
+    parser.add_argument('--fragments', type=int, default=64, help='number of fragments (default: 64)')
+    parser.add_argument('--samples', type=int, default=48, help='samples per fragment (default: 48)')
+    parser.add_argument(
+        '--subsamples', type=int, default=2, help='subsamples per sample, 0 to encrypt whole samples (default: 2)')
+    parser.add_argument('--schemes', nargs='+', choices=SCHEMES, default=SCHEMES, help='protection schemes')
+    parser.add_argument('--engines', nargs='+', choices=ENGINES, default=ENGINES, help='cases to run')
+    parser.add_argument('--processes', type=int, default=os.cpu_count(), help='processes of the parallel engine')
+    parser.add_argument('--repeat', type=int, default=3, help='number of runs per case (default: 3)')
+    parser.add_argument('--dir', help='directory of the generated files (default: a temporary directory)')
+    parser.add_argument('--baseline', help='compare the results to this file')
+    parser.add_argument('--save-baseline', metavar='FILE', help='write the results to this file')
+    parser.add_argument(
+        '--tolerance', type=float, default=0.2, help='allowed relative regression (default: 0.2)')
+    parser.add_argument(
+        '--min-delta', type=float, default=5, metavar='MS',
+        help='slowdowns below this many milliseconds are never regressions (default: 5)')
+    parser.add_argument('--worker', nargs=2, metavar=('ENGINE', 'FILE'), help=argparse.SUPPRESS)
+    parser.add_argument('--payload-sha256', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        return worker(*args.worker, args.repeat, args.processes, args.payload_sha256)
+
+    size = args.size << 20
+    results = {}
+    print(f'{"case":<24}{"time":>10}{"MB/s":>10}{"peak RSS":>12}{"written":>12}')
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as directory:
+        for scheme in args.schemes:
+            filepath = os.path.join(directory, f'{scheme}.mp4')
+            payload_sha256 = encrypted_file(
+                filepath, size, args.fragments, args.samples, args.subsamples, scheme.encode())
+            file_size = os.path.getsize(filepath)
+
+            for engine in args.engines:
+                if engine == 'pssh' and scheme != args.schemes[0]:
+                    continue
+
+                name = engine if engine == 'pssh' else f'{engine}/{scheme}'
+
+                results[name] = result = run_case(engine, filepath, args.repeat, args.processes, payload_sha256)
+
+                if 'error' in result:
+                    print(f'{name:<24}{result["error"]}')
+                    continue
+
+                seconds = result['seconds']
+                speed = None if engine == 'pssh' else file_size / seconds
+                print(f'{name:<24}{seconds * 1e3:>8.1f}ms{_format(speed, 1 << 20, ""):>10}'
+                      f'{_format(result["peak_rss"], 1 << 20, " MB"):>12}'
+                      f'{_format(result.get("bytes_written"), 1 << 20, " MB"):>12}')
+
+    if mismatches := [name for name, result in results.items() if result.get('error') == MISMATCH]:
+        print('Wrong output:', *mismatches, sep='\n  ')
+        return 1
+
+    params = {key: getattr(args, key) for key in ('size', 'fragments', 'samples', 'subsamples', 'processes')}
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump({'params': params, 'results': results}, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+        if baseline['params'] != params:
+            print(f'Baseline was recorded with different parameters: {baseline["params"]}')
+            return 1
+
+        if regressions := compare(results, baseline['results'], args.tolerance, args.min_delta / 1e3):
+            print('Regressions:', *regressions, sep='\n  ')
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,137 @@
+"""Check that license requests reuse one keep-alive connection per license server
+
+Two local license stubs answer the requests, every few of which are redirected (307 and 302)
+first. The requests are sent through the pooled license handler and through the regular yt-dlp
+handlers for comparison; the exit status is 1 if the pooled requests opened more than one
+connection to a stub or if a redirect was not followed correctly.
+
+Usage: python -m benchmarks.license_pool [--requests N] [--redirect-every N]
+"""
+import argparse
+import http.server
+import sys
+import threading
+import time
+
+from yt_dlp import YoutubeDL
+from yt_dlp.networking import Request
+
+from yt_dlp_plugins.postprocessor._license import license_requests
+from yt_dlp_plugins.postprocessor.mp4decrypt import Mp4DecryptPP
+
+CHALLENGE = b'\x08\x04' * 1024
+
+
+class _LicenseHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # the headers and the body are sent together
+    wbufsize = 1 << 16
+
+    def do_POST(self):
+        self.server.connections.add(self.client_address)
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+        if self.path == '/redirect/307':
+            return self._send(307, headers={'Location': '/license'})
+        if self.path == '/redirect/302':
+            return self._send(302, headers={'Location': '/license'})
+
+        self._send(200, b'license:' + body)
+
+    def do_GET(self):
+        # a 302 redirect turns the POST request into a GET request
+        self.server.connections.add(self.client_address)
+        self._send(200 if self.path == '/license' else 404, b'license:')
+
+    def _send(self, status, body=b'', headers={}):
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def _start_server():
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), _LicenseHandler)
+    server.daemon_threads = True
+    server.connections = set()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def run(servers, requests, redirect_every, pool_size):
+    """Send the license requests and return the seconds per request and the errors"""
+    errors = []
+
+    for server in servers:
+        server.connections.clear()
+
+    with YoutubeDL({'quiet': True}) as ydl:
+        Mp4DecryptPP(ydl, license_pool_size=str(pool_size))
+        start = time.perf_counter()
+
+        for i in range(requests):
+            server = servers[i % len(servers)]
+            path = '/license'
+            expected = b'license:' + CHALLENGE
+
+            if redirect_every and i % redirect_every == redirect_every - 1:
+                # the 307 redirect keeps the challenge, the 302 redirect drops it
+                path = '/redirect/307' if i // redirect_every % 2 else '/redirect/302'
+                if path == '/redirect/302':
+                    expected = b'license:'
+
+            url = f'http://127.0.0.1:{server.server_port}{path}'
+
+            with license_requests(), ydl.urlopen(Request(url, data=CHALLENGE)) as response:
+                body = response.read()
+                final_url = response.url
+
+            if body != expected:
+                errors.append(f'{path}: unexpected license {body[:16]!r}')
+            if not final_url.endswith('/license'):
+                errors.append(f'{path}: ended at {final_url}')
+
+        seconds = (time.perf_counter() - start) / requests
+
+    return seconds, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=100, help='number of license requests (default: 100)')
+    parser.add_argument(
+        '--redirect-every', type=int, default=5, metavar='N',
+        help='redirect every Nth request, 0 to never redirect (default: 5)')
+    args = parser.parse_args()
+
+    servers = [_start_server(), _start_server()]
+    failures = []
+    print(f'{"handler":<12}{"per request":>14}{"connections":>14}')
+
+    try:
+        for name, pool_size in (('pooled', 4), ('regular', 0)):
+            seconds, errors = run(servers, args.requests, args.redirect_every, pool_size)
+            connections = [len(server.connections) for server in servers]
+            print(f'{name:<12}{seconds * 1e3:>12.2f}ms{"/".join(map(str, connections)):>14}')
+
+            failures.extend(f'{name}: {error}' for error in errors)
+            if pool_size and any(count != 1 for count in connections):
+                failures.append(f'{name}: {connections} connections to the license servers instead of 1 each')
+    finally:
+        for server in servers:
+            server.shutdown()
+
+    if failures:
+        print('Failures:', *failures, sep='\n  ')
+        return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
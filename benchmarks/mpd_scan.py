@@ -0,0 +1,92 @@
+"""Compare the single pass MPD scan against the former multi-pass one
+
+Usage: python -m benchmarks.mpd_scan [--periods N] [--repeat N]
+"""
+import argparse
+import time
+import xml.etree.ElementTree as ET
+
+from yt_dlp_plugins.postprocessor.mp4decrypt import _scan_mpd
+
+WIDEVINE_URN = 'urn:uuid:edef8ba9-79d6-4ace-a3c8-27dcd51d21ed'
+
+
+def make_mpd(periods):
+    protection = (
+        '<ContentProtection schemeIdUri="urn:mpeg:dash:mp4protection:2011" value="cenc"'
+        ' cenc:default_KID="00112233-4455-6677-8899-aabbccddeeff"/>'
+        f'<ContentProtection schemeIdUri="{WIDEVINE_URN}"><cenc:pssh>AAAAOHBzc2g=</cenc:pssh></ContentProtection>')
+    segments = '<SegmentTemplate media="$Number$.m4s" initialization="init.mp4"/>'
+    period = (
+        '<Period id="p{0}">'
+        '<AdaptationSet mimeType="video/mp4">{1}{2}'
+        + ''.join(f'<Representation id="v{{0}}-{i}" bandwidth="{i}000000" width="1920" height="1080"/>' for i in range(6))
+        + '</AdaptationSet>'
+        '<AdaptationSet mimeType="audio/mp4" lang="en">{1}{2}<Role schemeIdUri="urn:mpeg:dash:role:2011" value="main"/>'
+        '<Representation id="a{0}-main" bandwidth="128000"/></AdaptationSet>'
+        '<AdaptationSet mimeType="audio/mp4" lang="en">{1}{2}<Role schemeIdUri="urn:mpeg:dash:role:2011" value="description"/>'
+        '<Representation id="a{0}-ad" bandwidth="128000"/></AdaptationSet>'
+        '</Period>')
+
+    return (
+        '<MPD xmlns="urn:mpeg:dash:schema:mpd:2011" xmlns:cenc="urn:mpeg:cenc:2013" type="static">'
+        + ''.join(period.format(i, protection, segments) for i in range(periods))
+        + '</MPD>')
+
+
+def multi_pass(mpd_doc):
+    elements = mpd_doc.findall('.//{*}ContentProtection')
+    default_kids = {
+        kid.replace('-', '').lower() for element in elements
+        if (kid := element.get('{urn:mpeg:cenc:2013}default_KID'))}
+    widevine = [element for element in elements if element.get('schemeIdUri').lower() == WIDEVINE_URN]
+
+    if widevine:
+        for parent in mpd_doc.findall('.//*/..[{*}ContentProtection]'):
+            for child in parent.findall('{*}ContentProtection'):
+                parent.remove(child)
+
+    roles = {}
+
+    for adaptation_set in mpd_doc.findall('.//{*}AdaptationSet'):
+        if adaptation_set.get('mimeType') != 'audio/mp4' and \
+                adaptation_set.get('contentType') != 'audio':
+            continue
+        if (role := adaptation_set.find('{*}Role')) is not None:
+            for representation in adaptation_set.findall('{*}Representation[@id]'):
+                roles[representation.get('id')] = role.get('value')
+
+    return widevine, default_kids, roles
+
+
+def measure(func, mpd, repeat):
+    best = float('inf')
+
+    for _ in range(repeat):
+        mpd_doc = ET.fromstring(mpd)
+        start = time.perf_counter()
+        func(mpd_doc)
+        best = min(best, time.perf_counter() - start)
+
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--periods', type=int, nargs='+', default=[10, 100, 1000], help='numbers of periods')
+    parser.add_argument('--repeat', type=int, default=5, help='number of runs per case (default: 5)')
+    args = parser.parse_args()
+
+    print(f'{"periods":<10}{"multi-pass":>14}{"single pass":>14}{"speedup":>10}')
+
+    for periods in args.periods:
+        mpd = make_mpd(periods)
+        old, new = multi_pass(ET.fromstring(mpd)), _scan_mpd(ET.fromstring(mpd))
+        assert (len(old[0]), old[1:]) == (len(new[0]), new[1:3]), periods
+
+        old, new = (measure(func, mpd, args.repeat) for func in (multi_pass, _scan_mpd))
+        print(f'{periods:<10}{old * 1e3:>12.2f}ms{new * 1e3:>12.2f}ms{old / new:>9.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""Compare the box walker against the former byte search for Widevine PSSH boxes
+
+Usage: python -m benchmarks.pssh_scan [--size MB] [--repeat N]
+"""
+import argparse
+import time
+
+from yt_dlp_plugins.postprocessor._mp4 import iter_pssh
+
+from ._mp4gen import PLAYREADY_SYSTEM_ID, WIDEVINE_SYSTEM_ID, init_segment, media_file
+
+
+def byte_search(raw):
+    offset = 0
+
+    while (offset := raw.find(b'pssh', offset)) != -1:
+        pssh_offset = offset - 4
+        size = int.from_bytes(raw[pssh_offset:offset], byteorder='big')
+        offset += size
+
+        if raw[pssh_offset + 12:pssh_offset + 28] == WIDEVINE_SYSTEM_ID:
+            return raw[pssh_offset:pssh_offset + size]
+
+    return None
+
+
+def box_walker(raw):
+    for pssh in iter_pssh(raw):
+        if pssh.system_id == WIDEVINE_SYSTEM_ID:
+            return raw[pssh.offset:pssh.end]
+
+    return None
+
+
+def measure(func, data, repeat):
+    best = float('inf')
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(data)
+        best = min(best, time.perf_counter() - start)
+
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size', type=int, default=256, help='size of the large files in MB (default: 256)')
+    parser.add_argument('--repeat', type=int, default=5, help='number of runs per case (default: 5)')
+    args = parser.parse_args()
+    size = args.size << 20
+
+    cases = (
+        ('init segment', init_segment(), 1000),
+        ('init segment, no Widevine', init_segment(system_ids=(PLAYREADY_SYSTEM_ID,)), 1000),
+        (f'{args.size} MB file', media_file(size), 1),
+        (f'{args.size} MB file, no Widevine', media_file(size, system_ids=(PLAYREADY_SYSTEM_ID,)), 1),
+        (f'{args.size} MB file, moov at end', media_file(size, moov_at_end=True), 1),
+    )
+
+    print(f'{"case":<40}{"byte search":>14}{"box walker":>14}{"speedup":>10}')
+
+    for name, data, loops in cases:
+        assert byte_search(data) == box_walker(data), name
+        old, new = (measure(lambda d: [func(d) for _ in range(loops)], data, args.repeat) / loops
+                    for func in (byte_search, box_walker))
+        print(f'{name:<40}{old * 1e6:>12.1f}us{new * 1e6:>12.1f}us{old / new:>9.1f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks._mp4gen import KEY, KID, fragment, init_segment
+from yt_dlp_plugins.postprocessor._cenc import CencDecrypter, UnsupportedError, decrypt_file, is_protected
+
+
+def _samples(count=4, size=256):
+    return [bytes([i]) * size for i in range(count)]
+
+
+class TestCencDecrypter(unittest.TestCase):
+    def test_decrypt(self):
+        samples = _samples()
+        data = bytearray(init_segment() + fragment(1, samples))
+        CencDecrypter({KID: KEY}).decrypt(data)
+        self.assertIn(b''.join(samples), data)
+        self.assertNotIn(b'encv', data)
+
+    def test_fragment_without_senc(self):
+        # the sample auxiliary information would only be reachable through saio
+        media = fragment(1, _samples()).replace(b'senc', b'free')
+        data = bytearray(init_segment() + media)
+        original = bytes(data)
+
+        decrypter = CencDecrypter({KID: KEY})
+        decrypter.decrypt(bytearray(init_segment()))
+        with self.assertRaises(UnsupportedError):
+            decrypter.validate(media)
+        self.assertEqual(bytes(media), original[-len(media):])
+
+        with self.assertRaises(UnsupportedError):
+            CencDecrypter({KID: KEY}).decrypt(data)
+
+    def test_malformed_fragment(self):
+        media = bytearray(fragment(1, _samples()))
+        trun = media.find(b'trun')
+        media[trun + 8:trun + 12] = b'\xff\xff\xff\xff'
+
+        decrypter = CencDecrypter({KID: KEY})
+        decrypter.decrypt(bytearray(init_segment()))
+        with self.assertRaises(UnsupportedError):
+            decrypter.validate(media)
+        with self.assertRaises(UnsupportedError):
+            decrypter.decrypt(media)
+
+    def test_decrypt_file_without_senc(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path, outpath = os.path.join(directory, 'in.mp4'), os.path.join(directory, 'out.mp4')
+            with open(path, 'wb') as f:
+                f.write(init_segment() + fragment(1, _samples()).replace(b'senc', b'free'))
+
+            with self.assertRaises(UnsupportedError):
+                decrypt_file(path, outpath, {KID: KEY})
+            self.assertTrue(is_protected(path))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+import os
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from yt_dlp import YoutubeDL
+from yt_dlp.extractor.common import InfoExtractor
+from yt_dlp.utils import InAdvancePagedList
+
+from yt_dlp_plugins.postprocessor.mp4decrypt import Mp4DecryptPP
+
+
+class _PlaylistIE(InfoExtractor):
+    _VALID_URL = r'lookahead:playlist'
+    resolved = []
+
+    def _real_extract(self, url):
+        def pagefunc(pagenum):
+            self.resolved.append(pagenum)
+            yield {'id': str(pagenum), 'title': str(pagenum), 'url': f'http://127.0.0.1:9/{pagenum}.mp4', 'ext': 'mp4'}
+
+        return self.playlist_result(InAdvancePagedList(pagefunc, 50, 1), 'playlist')
+
+
+def _look_ahead_threads():
+    return [thread for thread in threading.enumerate() if thread.name.startswith('mp4decrypt-look-ahead')]
+
+
+class TestLookAhead(unittest.TestCase):
+    def test_early_stop(self):
+        ydl = YoutubeDL({'quiet': True, 'lazy_playlist': True, 'simulate': True, 'playlist_items': '1:2'})
+        pp = Mp4DecryptPP(ydl, prefetch='3')
+        ydl.add_post_processor(pp, 'pre_process')
+        ie = _PlaylistIE()
+        ydl.add_info_extractor(ie)
+        prefetched = []
+        pp.prefetch_entry = prefetched.append
+
+        ydl.extract_info('lookahead:playlist', ie_key=ie.ie_key())
+
+        for thread in _look_ahead_threads():
+            thread.join(5)
+
+        self.assertFalse(_look_ahead_threads())
+        # nothing beyond the look-ahead of the last requested entry
+        self.assertLessEqual(max(_PlaylistIE.resolved), 1 + 3)
+        self.assertLessEqual(len(prefetched), 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
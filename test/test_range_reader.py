@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+import io
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from yt_dlp_plugins.postprocessor.mp4decrypt import _RangeReader
+
+
+class _ShortResponse(io.BytesIO):
+    """Response which returns at most 1000 bytes per read, like a socket"""
+    status = 200
+
+    def read(self, size=-1):
+        return super().read(min(size, 1000) if size >= 0 else 1000)
+
+
+class TestRangeReader(unittest.TestCase):
+    def setUp(self):
+        self.data = bytes(range(256)) * 40
+        self.requests = []
+
+    def _urlopen(self, request):
+        self.requests.append(request.headers['Range'])
+        return _ShortResponse(self.data)
+
+    def test_skip_short_reads(self):
+        reader = _RangeReader(self._urlopen, 'http://127.0.0.1/init.mp4', {})
+        self.assertEqual(reader.read(0, 8), self.data[:8])
+        self.assertEqual(reader.read(5000, 8), self.data[5000:5008])
+        self.assertEqual(self.requests, ['bytes=0-'])
+
+    def test_skip_past_end(self):
+        reader = _RangeReader(self._urlopen, 'http://127.0.0.1/init.mp4', {})
+        self.assertEqual(reader.read(0, 8), self.data[:8])
+        self.assertEqual(reader.read(len(self.data) + 100, 8), b'')
+        self.assertEqual(reader.bytes_read, len(self.data))
+
+
+if __name__ == '__main__':
+    unittest.main()
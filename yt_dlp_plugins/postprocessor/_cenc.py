@@ -0,0 +1,754 @@
+import array
+import concurrent.futures
+import mmap
+import multiprocessing
+import os
+import site
+import struct
+import traceback
+
+from Crypto.Cipher import AES
+from Crypto.Util.strxor import strxor
+
+from ._mp4 import (
+    PIFF_SAMPLE_ENCRYPTION,
+    Tenc,
+    UnsupportedError,
+    find_box,
+    iter_boxes,
+    iter_sample_entries,
+    parse_tenc,
+    walk,
+)
+
+_COPY_CHUNK_SIZE = 4 << 20
+_JOURNAL_BATCH_SIZE = 16 << 20
+_JOURNAL_HEADER = struct.Struct('>QQQ')
+_CHECKPOINT_INTERVAL = 16 << 20
+_KEYSTREAM_BATCH_SIZE = 4 << 20
+_BATCH_SAMPLE_SIZE = 16 << 10
+_counter_table = b''
+
+
+def parse_keys(args):
+    keys = {}
+
+    for option, value in zip(args[::2], args[1::2]):
+        kid, _, key = value.partition(':')
+
+        if option != '--key' or len(kid) != 32:
+            # mp4decrypt also accepts track IDs in place of KIDs
+            raise UnsupportedError(f'Unsupported key specification: {value}')
+
+        keys[bytes.fromhex(kid)] = bytes.fromhex(key)
+
+    return keys
+
+
+def _clear_box(data, start):
+    data[start + 4:start + 8] = b'free'
+
+
+def _find_sinf(data, start, end, cleared=True):
+    for box in iter_boxes(data, start, end):
+        if box[0] == b'sinf':
+            return box
+        # protection info of an entry that was already decrypted
+        if cleared and box[0] == b'free' and data[box[2] + 4:box[2] + 8] == b'frma':
+            return box
+
+    return None
+
+
+class _SampleEntry:
+    __slots__ = ('cipher', 'iv_size', 'key')
+
+    def __init__(self, iv_size=0, key=None):
+        self.iv_size = iv_size
+        self.key = key
+        self.cipher = key and AES.new(key, AES.MODE_ECB)
+
+
+class _Track:
+    __slots__ = ('default_sample_size', 'entries')
+
+    def __init__(self):
+        self.default_sample_size = 0
+        self.entries = []
+
+
+class CencDecrypter:
+    """Decrypts 'cenc' protected fragmented MP4 data in place
+
+    Box sizes never change: decrypted samples overwrite their ciphertext,
+    encrypted sample entries are renamed to their original format and
+    protection boxes (pssh, sinf, senc, saiz, saio) are turned into free boxes.
+    """
+
+    def __init__(self, keys):
+        self._keys = keys
+        self._tracks = {}
+
+    def decrypt(self, data, offset=0):
+        """Decrypt complete top-level boxes; offset is the file position of data[0]"""
+        view = memoryview(data)
+
+        try:
+            for box_type, start, payload, end in iter_boxes(view):
+                if box_type == b'moov':
+                    self._parse_moov(view, payload, end)
+                elif box_type == b'moof':
+                    self._decrypt_moof(view, start, payload, end, offset)
+        except (struct.error, IndexError) as e:
+            raise _malformed(e, offset)
+
+    def validate(self, data, offset=0):
+        """Check that the fragments of data can be decrypted, without modifying it"""
+        view = memoryview(data)
+
+        try:
+            for box_type, start, payload, end in iter_boxes(view):
+                if box_type == b'moof':
+                    self._decrypt_moof(view, start, payload, end, offset, dry_run=True)
+        except (struct.error, IndexError) as e:
+            raise _malformed(e, offset)
+
+    def _parse_moov(self, data, start, end):
+        tracks, fragmented = {}, False
+
+        for box_type, box_start, payload, box_end in iter_boxes(data, start, end):
+            if box_type == b'pssh':
+                _clear_box(data, box_start)
+            elif box_type == b'trak':
+                track_id, entries = self._parse_trak(data, payload, box_end)
+                tracks.setdefault(track_id, _Track()).entries = entries
+            elif box_type == b'mvex':
+                fragmented = True
+                for trex in iter_boxes(data, payload, box_end):
+                    if trex[0] == b'trex':
+                        track_id, default_sample_size = struct.unpack_from('>I8xI', data, trex[2] + 4)
+                        tracks.setdefault(track_id, _Track()).default_sample_size = default_sample_size
+
+        if not fragmented and any(entry.key for track in tracks.values() for entry in track.entries):
+            raise UnsupportedError('Only fragmented MP4 files are supported')
+
+        self._tracks = tracks
+
+    def _parse_trak(self, data, start, end):
+        if not (tkhd := find_box(data, start, end, b'tkhd')):
+            raise UnsupportedError('Missing tkhd box')
+
+        track_id = struct.unpack_from('>I', data, tkhd[2] + (20 if data[tkhd[2]] == 1 else 12))[0]
+        entries = []
+
+        for entry_start, children, entry_end in iter_sample_entries(data, start, end):
+            if children is not None and (sinf := _find_sinf(data, children, entry_end)):
+                entries.append(self._parse_sinf(data, entry_start, sinf))
+            else:
+                entries.append(_SampleEntry())
+
+        return track_id, entries
+
+    def _parse_sinf(self, data, entry_start, sinf):
+        _, sinf_start, payload, sinf_end = sinf
+        frma = find_box(data, payload, sinf_end, b'frma')
+        schm = find_box(data, payload, sinf_end, b'schm')
+        schi = find_box(data, payload, sinf_end, b'schi')
+        tenc_box = schi and find_box(data, schi[2], schi[3], b'tenc')
+
+        if not (frma and schm and tenc_box):
+            raise UnsupportedError('Incomplete protection scheme information')
+
+        scheme = bytes(data[schm[2] + 4:schm[2] + 8])
+        if scheme != b'cenc':
+            raise UnsupportedError(f'Unsupported protection scheme: {scheme.decode("latin-1")}')
+
+        tenc = parse_tenc(data, tenc_box[1], tenc_box[2])
+        entry = _SampleEntry()
+
+        if tenc.is_protected:
+            if not tenc.iv_size:
+                raise UnsupportedError('Constant IVs are not supported')
+            if tenc.kid not in self._keys:
+                raise UnsupportedError(f'No key for KID {tenc.kid.hex()}')
+            entry = _SampleEntry(tenc.iv_size, self._keys[tenc.kid])
+
+        data[entry_start + 4:entry_start + 8] = data[frma[2]:frma[2] + 4]
+        _clear_box(data, sinf_start)
+        return entry
+
+    def _decrypt_moof(self, data, moof_start, start, end, offset, dry_run=False):
+        data_end = moof_start
+
+        for box_type, box_start, payload, box_end in iter_boxes(data, start, end):
+            if box_type == b'pssh' and not dry_run:
+                _clear_box(data, box_start)
+            elif box_type == b'traf':
+                data_end = self._decrypt_traf(data, moof_start, data_end, payload, box_end, offset, dry_run)
+
+    def _decrypt_traf(self, data, moof_start, base, start, end, offset, dry_run=False):
+        tfhd, truns, senc, cleared = None, [], None, []
+
+        for box in iter_boxes(data, start, end):
+            box_type, box_start, payload, _ = box
+
+            if box_type == b'tfhd':
+                tfhd = box
+            elif box_type == b'trun':
+                truns.append(box)
+            elif box_type == b'senc' or (
+                    box_type == b'uuid' and data[payload:payload + 16] == PIFF_SAMPLE_ENCRYPTION):
+                senc = box
+                cleared.append(box_start)
+            elif box_type in (b'saiz', b'saio'):
+                cleared.append(box_start)
+            elif box_type in (b'sbgp', b'sgpd') and data[payload + 4:payload + 8] == b'seig':
+                raise UnsupportedError('Sample group encryption parameters are not supported')
+
+        if tfhd is None:
+            raise UnsupportedError('Missing tfhd box')
+
+        flags, track_id = struct.unpack_from('>II', data, tfhd[2])
+        track = self._tracks.get(track_id)
+        pos, sample_description_index = tfhd[2] + 8, 1
+        default_sample_size = track.default_sample_size if track else 0
+
+        if flags & 0x1:
+            base = struct.unpack_from('>Q', data, pos)[0] - offset
+            pos += 8
+        elif flags & 0x20000:
+            base = moof_start
+        if flags & 0x2:
+            sample_description_index = struct.unpack_from('>I', data, pos)[0]
+            pos += 4
+        if flags & 0x8:
+            pos += 4
+        if flags & 0x10:
+            default_sample_size = struct.unpack_from('>I', data, pos)[0]
+
+        samples, data_end = [], base
+        for trun in truns:
+            data_end = self._parse_trun(data, trun[2], base, data_end, default_sample_size, samples)
+
+        entries = track.entries if track else ()
+        entry = entries[sample_description_index - 1] if 0 < sample_description_index <= len(entries) else None
+
+        if senc is None:
+            # the sample auxiliary information is then only referenced by saio, which is not supported
+            if entry and entry.key and samples:
+                raise UnsupportedError(f'Missing sample encryption box for track {track_id}')
+        elif entry is None:
+            raise UnsupportedError(f'Unknown sample description for track {track_id}')
+        elif entry.key:
+            protected = self._protected_ranges(data, senc, samples, entry)
+            if not dry_run:
+                self._decrypt_samples(data, protected, entry)
+
+        if not dry_run:
+            for box_start in cleared:
+                _clear_box(data, box_start)
+
+        return data_end
+
+    @staticmethod
+    def _parse_trun(data, pos, base, data_end, default_sample_size, samples):
+        flags, sample_count = struct.unpack_from('>II', data, pos)
+        pos += 8
+
+        if flags & 0x1:
+            data_end = base + struct.unpack_from('>i', data, pos)[0]
+            pos += 4
+        if flags & 0x4:
+            pos += 4
+
+        size_pos = pos + (4 if flags & 0x100 else 0)
+        stride = 4 * bin(flags & 0xF00).count('1')
+
+        for _ in range(sample_count):
+            size = struct.unpack_from('>I', data, size_pos)[0] if flags & 0x200 else default_sample_size
+            samples.append((data_end, size))
+            data_end += size
+            size_pos += stride
+
+        return data_end
+
+    @staticmethod
+    def _protected_ranges(data, senc, samples, entry):
+        """Return (iv, protected ranges, protected size) of the encrypted samples, without modifying anything"""
+        box_type, _, pos, end = senc
+        if box_type == b'uuid':
+            pos += 16
+
+        flags, sample_count = struct.unpack_from('>II', data, pos)
+        pos += 8
+
+        if sample_count != len(samples):
+            raise UnsupportedError(f'Sample count mismatch: {sample_count} != {len(samples)}')
+        if samples and (samples[0][0] < 0 or samples[-1][0] + samples[-1][1] > len(data)):
+            raise UnsupportedError('Sample data lies outside of the fragment')
+
+        protected, iv_size = [], entry.iv_size
+
+        for sample_start, sample_size in samples:
+            iv = bytes(data[pos:pos + iv_size]).ljust(16, b'\0')
+            pos += iv_size
+
+            if not flags & 0x2:
+                if sample_size:
+                    protected.append((iv, ((sample_start, sample_size),), sample_size))
+                continue
+
+            subsample_count = struct.unpack_from('>H', data, pos)[0]
+            ranges, size, sample_end = [], 0, sample_start + sample_size
+            pos += 2
+
+            for clear_size, protected_size in struct.iter_unpack('>HI', data[pos:pos + 6 * subsample_count]):
+                sample_start += clear_size
+                ranges.append((sample_start, protected_size))
+                sample_start += protected_size
+                size += protected_size
+
+            if sample_start > sample_end:
+                raise UnsupportedError('Subsamples exceed the sample size')
+
+            pos += 6 * subsample_count
+            if size:
+                protected.append((iv, ranges, size))
+
+        if pos > end:
+            raise UnsupportedError('Truncated sample encryption box')
+
+        return protected
+
+    @staticmethod
+    def _decrypt_samples(data, protected, entry):
+        batch, batch_size = [], 0
+
+        for sample in protected:
+            iv, ranges, size = sample
+
+            # large samples gain nothing from batching, and the counter must not carry into the IV
+            if size >= _BATCH_SAMPLE_SIZE or int.from_bytes(iv[8:], 'big') + (size >> 4) >= 1 << 64:
+                cipher = AES.new(entry.key, AES.MODE_CTR, nonce=b'', initial_value=iv)
+                for start, length in ranges:
+                    chunk = data[start:start + length]
+                    cipher.decrypt(chunk, output=chunk)
+                continue
+
+            batch.append(sample)
+            batch_size += size
+
+            if batch_size >= _KEYSTREAM_BATCH_SIZE:
+                _ctr_decrypt(data, entry.cipher, batch)
+                batch, batch_size = [], 0
+
+        if batch:
+            _ctr_decrypt(data, entry.cipher, batch)
+
+
+def _malformed(error, offset):
+    # the frames of the original error hold views of the data, which may be a map that is closed afterwards
+    traceback.clear_frames(error.__traceback__)
+    return UnsupportedError(f'Malformed box in data at offset {offset}: {error}')
+
+
+def _counters(start, count):
+    """Return the big-endian 64-bit counters start..start + count - 1"""
+    global _counter_table
+
+    if start:
+        return struct.pack(f'>{count}Q', *range(start, start + count))
+
+    # other threads may replace the table concurrently
+    table = _counter_table
+
+    if len(table) < count * 8:
+        _counter_table = table = struct.pack(f'>{count * 2}Q', *range(count * 2))
+
+    return table[:count * 8]
+
+
+def _ctr_decrypt(data, cipher, samples):
+    """AES-CTR decrypt the protected ranges of small samples with a single ECB keystream and XOR"""
+    high, low, block_count = [], [], 0
+    span_start, span_end = len(data), 0
+
+    for iv, ranges, size in samples:
+        blocks = (size + 15) >> 4
+        high.append(iv[:8] * blocks)
+        low.append(_counters(int.from_bytes(iv[8:], 'big'), blocks))
+        block_count += blocks
+        if ranges[0][0] < span_start:
+            span_start = ranges[0][0]
+        if ranges[-1][0] + ranges[-1][1] > span_end:
+            span_end = ranges[-1][0] + ranges[-1][1]
+
+    keystream = array.array('Q', bytes(16 * block_count))
+    keystream[0::2] = array.array('Q', b''.join(high))
+    keystream[1::2] = array.array('Q', b''.join(low))
+    keystream = memoryview(keystream).cast('B')
+    cipher.encrypt(keystream, output=keystream)
+
+    # the keystream of every sample starts at a block boundary; clear bytes are XORed with zeros
+    mask, offset = bytearray(span_end - span_start), 0
+
+    for _, ranges, size in samples:
+        sample_offset = offset
+        for start, length in ranges:
+            mask[start - span_start:start - span_start + length] = keystream[offset:offset + length]
+            offset += length
+        offset = sample_offset + ((size + 15) & ~15)
+
+    span = data[span_start:span_end]
+    strxor(span, mask, output=span)
+
+
+def _iter_top_level_boxes(f):
+    file_size, start = f.seek(0, 2), 0
+
+    while start + 8 <= file_size:
+        f.seek(start)
+        header = f.read(16)
+        size, box_type = struct.unpack_from('>I4s', header)
+
+        if size == 1:
+            size = struct.unpack_from('>Q', header, 8)[0]
+        elif size == 0:
+            size = file_size - start
+
+        if size < 8 or start + size > file_size:
+            raise UnsupportedError(f'Malformed {box_type.decode("latin-1")} box at offset {start}')
+
+        yield box_type, start, start + size
+        start += size
+
+
+def read_init(filepath):
+    """Return the leading boxes of a file up to the end of moov, if it is present"""
+    with open(filepath, 'rb') as f:
+        try:
+            for box_type, _, end in _iter_top_level_boxes(f):
+                if box_type == b'moov':
+                    f.seek(0)
+                    return f.read(end)
+        except UnsupportedError:
+            # partially downloaded files end with a truncated box
+            pass
+
+    return None
+
+
+def is_protected(filepath):
+    if not (data := read_init(filepath)):
+        return False
+
+    return any(isinstance(record, Tenc) for record in walk(data))
+
+
+def read_protection(filepath):
+    """Return the protection schemes and the KIDs of the protected sample entries of a file"""
+    schemes, kids = set(), set()
+
+    if not (data := read_init(filepath)):
+        return schemes, kids
+
+    view = memoryview(data)
+    moov = find_box(view, 0, len(view), b'moov')
+
+    for box_type, _, payload, end in iter_boxes(view, moov[2], moov[3]):
+        if box_type != b'trak':
+            continue
+
+        for _, children, entry_end in iter_sample_entries(view, payload, end):
+            if children is None or not (sinf := _find_sinf(view, children, entry_end, cleared=False)):
+                continue
+
+            schm = find_box(view, sinf[2], sinf[3], b'schm')
+            schi = find_box(view, sinf[2], sinf[3], b'schi')
+            tenc = schi and find_box(view, schi[2], schi[3], b'tenc')
+
+            if not (schm and tenc):
+                raise UnsupportedError('Incomplete protection scheme information')
+
+            schemes.add(bytes(view[schm[2] + 4:schm[2] + 8]))
+            if (tenc := parse_tenc(view, tenc[1], tenc[2])).is_protected:
+                kids.add(tenc.kid)
+
+    return schemes, kids
+
+
+def iter_fragments(f):
+    """Yield (start, end, needs_decryption) ranges covering the file; a fragment spans moof..mdat"""
+    fragment_start = None
+
+    for box_type, start, end in _iter_top_level_boxes(f):
+        if box_type == b'moof' and fragment_start is None:
+            fragment_start = start
+        elif fragment_start is None:
+            yield start, end, box_type == b'moov'
+        elif box_type == b'mdat':
+            yield fragment_start, end, True
+            fragment_start = None
+
+    if fragment_start is not None:
+        raise UnsupportedError('Truncated fragment at end of file')
+
+
+def decrypt_file(filepath, tmppath, keys, progress_callback=None, journal_path=None):
+    """Decrypt a file into tmppath
+
+    With journal_path, the offset up to which tmppath is complete is recorded at fragment
+    boundaries, so that an interrupted decryption resumes from there on the next call.
+    """
+    decrypter = CencDecrypter(keys)
+
+    with open(filepath, 'rb') as src:
+        total = src.seek(0, 2)
+        ranges = list(iter_fragments(src))
+        resume_from = _resume_offset(tmppath, journal_path, total, ranges) if journal_path else 0
+
+        if resume_from:
+            # the track information is in the part that was already written
+            decrypter.decrypt(bytearray(read_init(filepath) or b''))
+
+        with open(tmppath, 'r+b' if resume_from else 'wb') as dest:
+            dest.truncate(resume_from)
+            dest.seek(resume_from)
+            checkpoint = resume_from
+
+            for start, end, needs_decryption in ranges:
+                if start < resume_from:
+                    continue
+                if progress_callback:
+                    progress_callback(start, total)
+
+                src.seek(start)
+
+                if needs_decryption:
+                    data = bytearray(end - start)
+                    src.readinto(data)
+                    decrypter.decrypt(data, start)
+                    dest.write(data)
+                else:
+                    while start < end:
+                        chunk = src.read(min(_COPY_CHUNK_SIZE, end - start))
+                        dest.write(chunk)
+                        start += len(chunk)
+
+                if journal_path and end - checkpoint >= _CHECKPOINT_INTERVAL:
+                    dest.flush()
+                    os.fsync(dest.fileno())
+                    _write_journal(journal_path, total, end, b'')
+                    checkpoint = end
+
+    if journal_path and os.path.exists(journal_path):
+        os.remove(journal_path)
+
+
+def _resume_offset(tmppath, journal_path, total, ranges):
+    try:
+        journal = _read_journal(journal_path, total)
+    except UnsupportedError:
+        return 0
+
+    if not journal or not os.path.exists(tmppath):
+        return 0
+
+    offset = journal[0]
+    if os.path.getsize(tmppath) < offset or offset not in {start for start, _, _ in ranges}:
+        return 0
+
+    return offset
+
+
+def count_fragments(filepath):
+    """Return the number of moof boxes of a file; raises UnsupportedError if it is truncated or malformed"""
+    with open(filepath, 'rb') as f:
+        return sum(box_type == b'moof' for box_type, _, _ in _iter_top_level_boxes(f))
+
+
+def decrypt_file_inplace(filepath, keys, journal_path, progress_callback=None):
+    """Decrypt a file where it lies, one batch of fragments at a time
+
+    The original data of the batch being decrypted is kept in a journal, so that an interrupted
+    decryption is rolled back to the start of that batch and resumed by the next call. The journal
+    is only left behind if the file is partially decrypted.
+    """
+    decrypter = CencDecrypter(keys)
+    resume_from = _rollback(filepath, journal_path)
+
+    # validate the track information before anything is modified
+    decrypter.decrypt(bytearray(read_init(filepath) or b''))
+
+    with open(filepath, 'r+b') as f:
+        total = f.seek(0, 2)
+        ranges = [(start, end) for start, end, needs_decryption in iter_fragments(f)
+                  if needs_decryption and start >= resume_from]
+
+        if not ranges:
+            if os.path.exists(journal_path):
+                os.remove(journal_path)
+            return
+
+        with mmap.mmap(f.fileno(), 0) as data, memoryview(data) as view:
+            # a fragment which cannot be decrypted must not leave the file partially decrypted
+            try:
+                for start, end in ranges:
+                    decrypter.validate(view[start:end], start)
+            except UnsupportedError as e:
+                traceback.clear_frames(e.__traceback__)
+                raise
+
+            batch = []
+
+            for i, (start, end) in enumerate(ranges):
+                batch.append((start, end))
+
+                if end - batch[0][0] < _JOURNAL_BATCH_SIZE and i < len(ranges) - 1:
+                    continue
+                if progress_callback:
+                    progress_callback(batch[0][0], total)
+
+                _decrypt_batch(decrypter, data, view, batch, journal_path, not resume_from and batch[0] == ranges[0])
+                batch = []
+
+    os.remove(journal_path)
+
+
+def _decrypt_batch(decrypter, data, view, batch, journal_path, first):
+    start, end = batch[0][0], batch[-1][1]
+    original = bytes(view[start:end])
+    _write_journal(journal_path, len(data), start, original)
+
+    try:
+        for range_start, range_end in batch:
+            decrypter.decrypt(view[range_start:range_end], range_start)
+    except BaseException as e:
+        # release the views of the map held by the traceback, so that it can be closed
+        traceback.clear_frames(e.__traceback__)
+        view[start:end] = original
+        data.flush()
+
+        if first:
+            # nothing was decrypted yet, so the file is left as it was
+            os.remove(journal_path)
+        raise
+
+    offset = start - start % mmap.ALLOCATIONGRANULARITY
+    data.flush(offset, end - offset)
+
+
+def _write_journal(journal_path, size, start, original):
+    with open(journal_path + '.tmp', 'wb') as f:
+        f.write(_JOURNAL_HEADER.pack(size, start, start + len(original)))
+        f.write(original)
+        f.flush()
+        os.fsync(f.fileno())
+
+    os.replace(journal_path + '.tmp', journal_path)
+
+
+def _read_journal(journal_path, size):
+    """Return the start offset and the original data recorded for a file of the given size, or None"""
+    try:
+        with open(journal_path, 'rb') as f:
+            header = f.read(_JOURNAL_HEADER.size)
+            original = f.read()
+    except FileNotFoundError:
+        return None
+
+    if len(header) != _JOURNAL_HEADER.size:
+        raise UnsupportedError(f'Corrupted journal: {journal_path}')
+
+    journal_size, start, end = _JOURNAL_HEADER.unpack(header)
+    if len(original) != end - start:
+        raise UnsupportedError(f'Corrupted journal: {journal_path}')
+    if journal_size != size:
+        # left behind by an earlier download of another file
+        os.remove(journal_path)
+        return None
+
+    return start, original
+
+
+def _rollback(filepath, journal_path):
+    """Restore the data of an interrupted batch; returns the offset from which decryption resumes"""
+    if not (journal := _read_journal(journal_path, os.path.getsize(filepath))):
+        return 0
+
+    start, original = journal
+
+    with open(filepath, 'r+b') as f:
+        f.seek(start)
+        f.write(original)
+        f.flush()
+        os.fsync(f.fileno())
+
+    return start
+
+
+def _decrypt_ranges(filepath, tmppath, keys, init, ranges):
+    decrypter = CencDecrypter(keys)
+    decrypter.decrypt(bytearray(init))
+
+    with open(filepath, 'rb') as src, open(tmppath, 'r+b') as dest, \
+            mmap.mmap(src.fileno(), 0, access=mmap.ACCESS_READ) as src_map, \
+            mmap.mmap(dest.fileno(), 0) as dest_map:
+        for start, end, needs_decryption in ranges:
+            dest_map[start:end] = src_map[start:end]
+
+            if needs_decryption:
+                with memoryview(dest_map) as view:
+                    decrypter.decrypt(view[start:end], start)
+
+    return ranges[-1][1] - ranges[0][0]
+
+
+def decrypt_file_parallel(filepath, tmppath, keys, processes, progress_callback=None):
+    """Decrypt fragment ranges of a memory-mapped file in a process pool"""
+    with open(filepath, 'rb') as src:
+        total = src.seek(0, 2)
+        ranges = list(iter_fragments(src))
+
+    # validate the track information before spawning workers
+    init = read_init(filepath) or b''
+    CencDecrypter(keys).decrypt(bytearray(init))
+
+    with open(tmppath, 'wb') as dest:
+        dest.truncate(total)
+
+    if not total:
+        return
+
+    batch_size = max(total // (processes * 8), _COPY_CHUNK_SIZE)
+    batches, batch = [], []
+
+    for r in ranges:
+        batch.append(r)
+        if r[1] - batch[0][0] >= batch_size:
+            batches.append(batch)
+            batch = []
+
+    if batch:
+        batches.append(batch)
+
+    done = 0
+
+    # this runs in a thread of a multithreaded process, which must not be forked. Spawned processes
+    # cannot import plugins loaded from the yt-dlp plugin directories unless they are on their path
+    plugin_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+    with concurrent.futures.ProcessPoolExecutor(
+            processes, mp_context=multiprocessing.get_context('spawn'),
+            initializer=site.addsitedir, initargs=(plugin_root,)) as executor:
+        futures = [executor.submit(_decrypt_ranges, filepath, tmppath, keys, init, batch) for batch in batches]
+
+        try:
+            for future in concurrent.futures.as_completed(futures):
+                done += future.result()
+                if progress_callback:
+                    progress_callback(done, total)
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
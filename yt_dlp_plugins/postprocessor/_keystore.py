@@ -0,0 +1,137 @@
+import contextlib
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+_SCHEMA_VERSION = 1
+_CACHE_SECTION = 'mp4decrypt-pssh'
+_UPSERT_PSSH = '''
+    INSERT INTO pssh (hash, pssh, kids, updated) VALUES (?, ?, ?, ?)
+    ON CONFLICT (hash) DO UPDATE SET pssh = excluded.pssh, kids = excluded.kids, updated = excluded.updated'''
+_UPSERT_KEY = '''
+    INSERT INTO keys (kid, key, updated) VALUES (?, ?, ?)
+    ON CONFLICT (kid) DO UPDATE SET key = excluded.key, updated = excluded.updated'''
+_UPSERT_FAILURE = '''
+    INSERT INTO failures (kind, key, expires) VALUES (?, ?, ?)
+    ON CONFLICT (kind, key) DO UPDATE SET expires = excluded.expires'''
+
+
+def pssh_hash(pssh):
+    return hashlib.md5(pssh.encode('ascii')).hexdigest()
+
+
+class KeyStore:
+    """Content keys shared between processes through an SQLite database in WAL mode"""
+
+    def __init__(self, path):
+        self._conn = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        self._lock = threading.Lock()
+
+        with self._lock:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+
+        with self._transaction() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS pssh (
+                    hash TEXT PRIMARY KEY,
+                    pssh TEXT NOT NULL,
+                    kids TEXT NOT NULL,
+                    updated REAL NOT NULL)''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS failures (
+                    kind TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    expires REAL NOT NULL,
+                    PRIMARY KEY (kind, key))''')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS keys (
+                    kid TEXT PRIMARY KEY,
+                    key TEXT NOT NULL,
+                    updated REAL NOT NULL)''')
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+
+            self._conn.execute('COMMIT')
+
+    def load(self, pssh):
+        with self._lock:
+            row = self._conn.execute('SELECT pssh, kids FROM pssh WHERE hash = ?', (pssh_hash(pssh),)).fetchone()
+
+        if not row or row[0] != pssh:
+            return None
+
+        return self.get_keys(row[1].split())
+
+    def get_keys(self, kids):
+        """Return the key arguments for all kids, or None if any of them is unknown"""
+        if not kids:
+            return None
+
+        with self._lock:
+            found = dict(self._conn.execute(
+                f'SELECT kid, key FROM keys WHERE kid IN ({",".join("?" * len(kids))})', tuple(kids)))
+
+        if any(kid not in found for kid in kids):
+            return None
+
+        return tuple(arg for kid in kids for arg in ('--key', f'{kid}:{found[kid]}'))
+
+    def store(self, pssh, keys):
+        if keys:
+            with self._transaction() as conn:
+                self._upsert(conn, pssh, keys, time.time())
+
+    @staticmethod
+    def _upsert(conn, pssh, keys, updated):
+        kids = [keyarg.partition(':') for keyarg in keys[1::2]]
+
+        conn.execute(_UPSERT_PSSH, (pssh_hash(pssh), pssh, ' '.join(kid for kid, _, _ in kids), updated))
+        conn.executemany(_UPSERT_KEY, [(kid, key, updated) for kid, _, key in kids])
+
+    def has_failure(self, kind, key):
+        with self._lock:
+            return bool(self._conn.execute(
+                'SELECT 1 FROM failures WHERE kind = ? AND key = ? AND expires > ?', (kind, key, time.time())).fetchone())
+
+    def add_failure(self, kind, key, expires):
+        with self._transaction() as conn:
+            conn.execute(_UPSERT_FAILURE, (kind, key, expires))
+            conn.execute('DELETE FROM failures WHERE expires <= ?', (time.time(),))
+
+    def migrate(self, cache):
+        """Import the entries of the yt-dlp cache once; returns the number of imported entries"""
+        with self._lock:
+            if not cache.enabled or self._conn.execute('PRAGMA user_version').fetchone()[0] >= _SCHEMA_VERSION:
+                return 0
+
+        entries = []
+
+        with contextlib.suppress(OSError):
+            for filename in os.listdir(os.path.join(cache._get_root_dir(), _CACHE_SECTION)):
+                if filename.endswith('.json') and (data := cache.load(_CACHE_SECTION, filename[:-5])) \
+                        and data.get('pssh') and data.get('keys'):
+                    entries.append((data['pssh'], data['keys']))
+
+        imported = 0
+
+        with self._transaction() as conn:
+            for pssh, keys in entries:
+                if not conn.execute('SELECT 1 FROM pssh WHERE hash = ?', (pssh_hash(pssh),)).fetchone():
+                    self._upsert(conn, pssh, keys, 0)
+                    imported += 1
+
+            conn.execute(f'PRAGMA user_version = {_SCHEMA_VERSION}')
+
+        return imported
@@ -0,0 +1,164 @@
+import collections
+import contextlib
+import http.client
+import io
+import ssl
+import threading
+import urllib.parse
+import urllib.request
+
+from yt_dlp.networking._helper import get_redirect_method
+from yt_dlp.networking.common import RequestHandler, Response
+from yt_dlp.networking.exceptions import HTTPError, SSLError, TransportError, UnsupportedRequest
+
+_local = threading.local()
+_RETRYABLE_ERRORS = (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError)
+
+
+@contextlib.contextmanager
+def license_requests():
+    """Send the requests made by this thread through LicenseRH"""
+    active = getattr(_local, 'active', False)
+    _local.active = True
+
+    try:
+        yield
+    finally:
+        _local.active = active
+
+
+def is_license_request():
+    return getattr(_local, 'active', False)
+
+
+class LicenseRH(RequestHandler):
+    """Keep-alive connections to license servers, pooled per host
+
+    Only requests made within license_requests() are accepted; proxied requests and
+    requests with unsupported extensions (e.g. impersonate) are left to the other handlers
+    """
+    _SUPPORTED_URL_SCHEMES = ('http', 'https')
+    _MAX_REDIRECTS = 10
+
+    def __init__(self, *, pool_size=4, **kwargs):
+        super().__init__(**kwargs)
+        self.pool_size = pool_size
+        self._pools = collections.defaultdict(list)
+        self._lock = threading.Lock()
+        self._ssl_context = None
+
+    def _validate(self, request):
+        if not is_license_request():
+            raise UnsupportedRequest('Not a license request')
+
+        super()._validate(request)
+
+    def _check_extensions(self, extensions):
+        super()._check_extensions(extensions)
+        extensions.pop('cookiejar', None)
+        extensions.pop('timeout', None)
+        extensions.pop('keep_header_casing', None)
+
+    def _prepare_headers(self, _, headers):
+        # license responses are small, so they are never compressed
+        headers['Accept-Encoding'] = 'identity'
+
+    def _send(self, request):
+        headers = self._get_headers(request)
+        cookiejar = self._get_cookiejar(request)
+        timeout = self._calculate_timeout(request)
+        method, url, data = request.method, request.url, request.data
+
+        for _ in range(self._MAX_REDIRECTS + 1):
+            if 'Cookie' not in headers and (cookie := cookiejar.get_cookie_header(url)):
+                headers = {**headers, 'Cookie': cookie}
+
+            response, body = self._request(method, url, data, headers, timeout)
+            cookiejar.extract_cookies(response, urllib.request.Request(url))
+            location = response.getheader('Location')
+
+            if response.status not in (301, 302, 303, 307, 308) or not location:
+                break
+
+            url = urllib.parse.urljoin(url, location)
+            if (method := get_redirect_method(method, response.status)) == 'GET':
+                data = None
+                headers = {k: v for k, v in headers.items() if k.lower() not in ('content-type', 'content-length')}
+            headers.pop('Cookie', None)
+
+        res = Response(io.BytesIO(body), url, response.headers, response.status, response.reason)
+
+        if not 200 <= res.status < 300:
+            raise HTTPError(res, redirect_loop=300 <= res.status < 400)
+
+        return res
+
+    def _request(self, method, url, data, headers, timeout):
+        parsed = urllib.parse.urlsplit(url)
+        pool_key = parsed.scheme, parsed.hostname, parsed.port
+        path = parsed.path or '/'
+
+        if parsed.query:
+            path += '?' + parsed.query
+
+        while True:
+            conn, reused = self._acquire(pool_key, timeout)
+
+            try:
+                conn.request(method, path, body=data, headers=headers)
+                response = conn.getresponse()
+                body = response.read()
+            except _RETRYABLE_ERRORS as e:
+                conn.close()
+                # the server closed an idle connection; retry on a new one
+                if reused:
+                    continue
+                raise TransportError(cause=e) from e
+            except ssl.SSLError as e:
+                conn.close()
+                raise SSLError(cause=e) from e
+            except (OSError, http.client.HTTPException) as e:
+                conn.close()
+                raise TransportError(cause=e) from e
+
+            self._release(pool_key, conn, response)
+            return response, body
+
+    def _acquire(self, pool_key, timeout):
+        with self._lock:
+            if pool := self._pools[pool_key]:
+                conn = pool.pop()
+                conn.timeout = timeout
+                if conn.sock:
+                    conn.sock.settimeout(timeout)
+                return conn, True
+
+        scheme, host, port = pool_key
+        source_address = (self.source_address, 0) if self.source_address else None
+
+        if scheme == 'https':
+            with self._lock:
+                if not self._ssl_context:
+                    self._ssl_context = self._make_sslcontext()
+            return http.client.HTTPSConnection(
+                host, port, timeout=timeout, source_address=source_address, context=self._ssl_context), False
+
+        return http.client.HTTPConnection(host, port, timeout=timeout, source_address=source_address), False
+
+    def _release(self, pool_key, conn, response):
+        if not response.will_close and conn.sock:
+            with self._lock:
+                if len(pool := self._pools[pool_key]) < self.pool_size:
+                    pool.append(conn)
+                    return
+
+        conn.close()
+
+    def close(self):
+        with self._lock:
+            pools, self._pools = self._pools, collections.defaultdict(list)
+
+        for pool in pools.values():
+            for conn in pool:
+                with contextlib.suppress(OSError):
+                    conn.close()
@@ -0,0 +1,129 @@
+import contextlib
+import json
+import os
+import threading
+import time
+
+# name: (label, help); all metrics are counters
+METRICS = {
+    'init_probes': (None, 'Init segments probed for a PSSH'),
+    'init_probe_seconds': (None, 'Time spent probing init segments'),
+    'init_probe_bytes': (None, 'Bytes read while probing init segments'),
+    'license_requests': ('host', 'License requests'),
+    'license_seconds': ('host', 'Round-trip time of license requests'),
+    'key_cache_hits': ('cache', 'Keys found in the memory or disk cache'),
+    'key_cache_misses': ('cache', 'Keys not found in the memory or disk cache'),
+    'decrypted_parts': ('format', 'Decrypted formats'),
+    'decrypt_seconds': ('format', 'Time spent decrypting formats'),
+    'decrypt_bytes': ('format', 'Bytes of encrypted input'),
+    'bytes_written': ('format', 'Bytes of decrypted output written to disk'),
+    'merge_seconds': (None, 'Time spent merging and decrypting formats with ffmpeg'),
+}
+# labels which are only kept per job, as they are unbounded
+_JOB_LABELS = frozenset(('format',))
+
+_local = threading.local()
+
+
+class Metrics:
+    def __init__(self):
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def add(self, name, value=1, label=None):
+        with self._lock:
+            self._values[name, label] = self._values.get((name, label), 0) + value
+
+    def to_dict(self):
+        """Return {name: value} or {name: {label: value}} for labelled metrics"""
+        result = {}
+
+        with self._lock:
+            for (name, label), value in self._values.items():
+                # a labelled metric may be recorded without its label, e.g. for a format without ID
+                if METRICS[name][0] is None:
+                    result[name] = value
+                else:
+                    result.setdefault(name, {})[label] = value
+
+        for part, seconds in result.get('decrypt_seconds', {}).items():
+            if seconds and (size := result.get('decrypt_bytes', {}).get(part)):
+                result.setdefault('decrypt_throughput', {})[part] = size / seconds
+
+        return result
+
+    def to_prometheus(self):
+        lines = []
+
+        with self._lock:
+            values = sorted(self._values.items(), key=lambda item: (item[0][0], item[0][1] or ''))
+
+        for name, (label_name, description) in METRICS.items():
+            if not (samples := [(label, value) for (metric, label), value in values if metric == name]):
+                continue
+
+            name = f'mp4decrypt_{name}_total'
+            lines += (f'# HELP {name} {description}', f'# TYPE {name} counter')
+
+            for label, value in samples:
+                label = '' if label is None else '{%s="%s"}' % (label_name, _escape(label))
+                lines.append(f'{name}{label} {value}')
+
+        return ''.join(f'{line}\n' for line in lines)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+@contextlib.contextmanager
+def job_metrics(metrics):
+    """Also record the metrics of this thread into those of a job"""
+    job = getattr(_local, 'job', None)
+    _local.job = metrics
+
+    try:
+        yield
+    finally:
+        _local.job = job
+
+
+def record(totals, name, value=1, label=None):
+    totals.add(name, value, None if METRICS[name][0] in _JOB_LABELS else label)
+
+    if job := getattr(_local, 'job', None):
+        job.add(name, value, label)
+
+
+def current_job():
+    return getattr(_local, 'job', None)
+
+
+class MetricsWriter:
+    """Append the metrics of each job as JSON lines, or keep the totals in a Prometheus textfile"""
+
+    def __init__(self, path, format_='json'):
+        self._path = path
+        self._format = format_
+        self._lock = threading.Lock()
+
+    def write(self, totals, job, info):
+        if self._format == 'json':
+            line = json.dumps({
+                'timestamp': time.time(),
+                'id': info.get('id'),
+                'extractor': info.get('extractor_key'),
+                'metrics': job.to_dict(),
+            })
+
+            with self._lock, open(self._path, 'a', encoding='utf-8') as f:
+                f.write(line + '\n')
+            return
+
+        # the textfile collector must never read a partially written file
+        tmppath = f'{self._path}.{os.getpid()}.tmp'
+
+        with self._lock:
+            with open(tmppath, 'w', encoding='utf-8') as f:
+                f.write(totals.to_prometheus())
+            os.replace(tmppath, self._path)
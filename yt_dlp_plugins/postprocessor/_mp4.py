@@ -0,0 +1,164 @@
+import struct
+from typing import NamedTuple
+
+CONTAINER_BOXES = frozenset((
+    b'moov', b'trak', b'mdia', b'minf', b'stbl', b'mvex', b'moof', b'traf', b'sinf', b'schi'))
+PIFF_SAMPLE_ENCRYPTION = bytes.fromhex('a2394f525a9b4f14a2446c427c648df4')
+
+
+class UnsupportedError(Exception):
+    pass
+
+
+class Pssh(NamedTuple):
+    offset: int
+    end: int
+    version: int
+    system_id: bytes
+    kids: tuple
+    data: memoryview
+
+
+class Tenc(NamedTuple):
+    offset: int
+    is_protected: int
+    iv_size: int
+    kid: bytes
+    constant_iv: bytes
+    crypt_byte_block: int
+    skip_byte_block: int
+
+
+class Senc(NamedTuple):
+    offset: int
+    flags: int
+    sample_count: int
+    entries_offset: int
+
+
+def iter_boxes(data, start=0, end=None):
+    """Yield (type, start, payload start, end) of consecutive boxes"""
+    if end is None:
+        end = len(data)
+
+    while start + 8 <= end:
+        size, box_type = struct.unpack_from('>I4s', data, start)
+        header_size = 8
+
+        if size == 1:
+            size = struct.unpack_from('>Q', data, start + 8)[0]
+            header_size = 16
+        elif size == 0:
+            size = end - start
+
+        if size < header_size or start + size > end:
+            raise UnsupportedError(f'Malformed {box_type.decode("latin-1")} box at offset {start}')
+
+        yield box_type, start, start + header_size, start + size
+        start += size
+
+
+def find_box(data, start, end, box_type):
+    return next((box for box in iter_boxes(data, start, end) if box[0] == box_type), None)
+
+
+def iter_sample_entries(data, start, end):
+    """Yield (start, children, end) of each sample entry in a trak; children is None for non-AV entries"""
+    handler = None
+
+    for box_type in (b'mdia', b'minf', b'stbl', b'stsd'):
+        if not (box := find_box(data, start, end, box_type)):
+            return
+        if box_type == b'mdia' and (hdlr := find_box(data, box[2], box[3], b'hdlr')):
+            handler = bytes(data[hdlr[2] + 8:hdlr[2] + 12])
+        _, _, start, end = box
+
+    for box_type, box_start, payload, box_end in iter_boxes(data, start + 8, end):
+        if handler == b'vide':
+            yield box_start, payload + 78, box_end
+        elif handler == b'soun':
+            sound_version = struct.unpack_from('>H', data, payload + 8)[0]
+            yield box_start, payload + 28 + {1: 16, 2: 36}.get(sound_version, 0), box_end
+        elif box_type in (b'encs', b'enct'):
+            raise UnsupportedError('Encrypted text tracks are not supported')
+        else:
+            yield box_start, None, box_end
+
+
+def walk(data, stop_after_moov=True):
+    """Yield Pssh, Tenc and Senc records found in the box tree without copying the data"""
+    view = memoryview(data)
+
+    for box in iter_boxes(view):
+        yield from _walk_box(view, box)
+
+        if stop_after_moov and box[0] in (b'moov', b'moof'):
+            return
+
+
+def iter_pssh(data):
+    """Yield the top-level PSSH boxes and those of the first moov or moof"""
+    view = memoryview(data)
+
+    for box_type, start, payload, end in iter_boxes(view):
+        if box_type == b'pssh':
+            yield _parse_pssh(view, start, payload, end)
+        elif box_type in (b'moov', b'moof'):
+            for child_type, child_start, child_payload, child_end in iter_boxes(view, payload, end):
+                if child_type == b'pssh':
+                    yield _parse_pssh(view, child_start, child_payload, child_end)
+            return
+
+
+def _walk_box(data, box):
+    box_type, start, payload, end = box
+
+    if box_type == b'pssh':
+        yield _parse_pssh(data, start, payload, end)
+    elif box_type == b'tenc':
+        yield parse_tenc(data, start, payload)
+    elif box_type == b'senc' or (box_type == b'uuid' and data[payload:payload + 16] == PIFF_SAMPLE_ENCRYPTION):
+        if box_type == b'uuid':
+            payload += 16
+        flags, sample_count = struct.unpack_from('>II', data, payload)
+        yield Senc(start, flags & 0xFFFFFF, sample_count, payload + 8)
+    elif box_type == b'trak':
+        for child in iter_boxes(data, payload, end):
+            if child[0] != b'mdia':
+                yield from _walk_box(data, child)
+
+        for _, children, entry_end in iter_sample_entries(data, payload, end):
+            if children is not None:
+                for child in iter_boxes(data, children, entry_end):
+                    yield from _walk_box(data, child)
+    elif box_type in CONTAINER_BOXES:
+        for child in iter_boxes(data, payload, end):
+            yield from _walk_box(data, child)
+
+
+def _parse_pssh(data, start, payload, end):
+    version = data[payload]
+    system_id = bytes(data[payload + 4:payload + 20])
+    pos, kids = payload + 20, ()
+
+    if version > 0:
+        kid_count = struct.unpack_from('>I', data, pos)[0]
+        kids = tuple(bytes(data[pos + 4 + 16 * i:pos + 20 + 16 * i]) for i in range(kid_count))
+        pos += 4 + 16 * kid_count
+
+    data_size = struct.unpack_from('>I', data, pos)[0]
+    return Pssh(start, end, version, system_id, kids, data[pos + 4:min(pos + 4 + data_size, end)])
+
+
+def parse_tenc(data, start, payload):
+    version = data[payload]
+    pattern, is_protected, iv_size = data[payload + 5:payload + 8]
+    constant_iv = b''
+
+    if is_protected and not iv_size:
+        constant_iv_size = data[payload + 24]
+        constant_iv = bytes(data[payload + 25:payload + 25 + constant_iv_size])
+
+    return Tenc(
+        start, is_protected, iv_size, bytes(data[payload + 8:payload + 24]), constant_iv,
+        pattern >> 4 if version else 0, pattern & 0xF if version else 0)
@@ -1,23 +1,62 @@
+import base64
+import collections
+import concurrent.futures
+import contextlib
+import functools
 import hashlib
+import itertools
 import os
 import re
+import struct
 import subprocess
 import tempfile
+import threading
+import time
+import urllib.parse
 
 from pywidevine.cdm import Cdm
 from pywidevine.device import Device
 from pywidevine.pssh import PSSH
+from yt_dlp.downloader import get_suitable_downloader
+from yt_dlp.downloader.common import FileDownloader
+from yt_dlp.downloader.fragment import FragmentFD
 from yt_dlp.networking.common import Request
+from yt_dlp.networking.exceptions import RequestError
 from yt_dlp.postprocessor.common import PostProcessor
+from yt_dlp.postprocessor.ffmpeg import FFmpegMergerPP, FFmpegPostProcessorError
 from yt_dlp.utils import (
+    DownloadError,
+    InAdvancePagedList,
     Popen,
     PostProcessingError,
     UnavailableVideoError,
+    expand_path,
+    parse_m3u8_attributes,
     prepend_extension,
+    remove_start,
     truncate_string,
+    update_url_query,
+    urljoin,
     variadic,
 )
 
+from ._cenc import (
+    CencDecrypter,
+    UnsupportedError,
+    count_fragments,
+    decrypt_file,
+    decrypt_file_inplace,
+    decrypt_file_parallel,
+    is_protected,
+    parse_keys,
+    read_init,
+    read_protection,
+)
+from ._keystore import KeyStore, pssh_hash
+from ._license import LicenseRH, is_license_request, license_requests
+from ._metrics import Metrics, MetricsWriter, current_job, job_metrics, record
+from ._mp4 import iter_boxes, iter_pssh
+
 
 def _inject_mixin(obj, mixin, pp):
     if obj.__module__ != __name__:
@@ -28,32 +67,390 @@ def _inject_mixin(obj, mixin, pp):
         })
 
 
+_WIDEVINE_URN = PSSH.SystemId.Widevine.urn
+
+
+def _scan_mpd(mpd_doc):
+    """Return the Widevine ContentProtection elements, default KIDs, audio roles
+    and per-Representation protection of an MPD in a single pass
+
+    All ContentProtection elements are removed if Widevine is used, so that formats are treated as unprotected.
+    """
+    protection, representations, roles = {}, [], {}
+
+    for parent in mpd_doc.iter():
+        role, representation_ids = None, []
+
+        for child in parent:
+            name = child.tag.rpartition('}')[2] if isinstance(child.tag, str) else None
+
+            if name == 'ContentProtection':
+                protection.setdefault(parent, []).append(child)
+            elif name == 'Representation' and (representation_id := child.get('id')) is not None:
+                representations.append((parent, child))
+                representation_ids.append(representation_id)
+            elif name == 'Role' and role is None:
+                role = child
+
+        if role is not None and representation_ids and parent.tag.rpartition('}')[2] == 'AdaptationSet' \
+                and (parent.get('mimeType') == 'audio/mp4' or parent.get('contentType') == 'audio'):
+            roles.update(dict.fromkeys(representation_ids, role.get('value')))
+
+    elements = [element for children in protection.values() for element in children]
+    widevine = [element for element in elements if _is_widevine(element)]
+    summaries, representation_protection = {}, {}
+
+    for adaptation_set, representation in representations:
+        owner = representation if representation in protection else adaptation_set
+
+        if owner not in summaries and (children := protection.get(owner)):
+            summaries[owner] = (
+                next((element.findtext('./{*}pssh') for element in children if _is_widevine(element)), None),
+                tuple(sorted(_default_kids(children))))
+
+        if owner in summaries:
+            representation_protection[representation.get('id')] = summaries[owner]
+
+    if widevine:
+        for parent, children in protection.items():
+            for element in children:
+                parent.remove(element)
+
+    return widevine, _default_kids(elements), roles, representation_protection
+
+
+def _is_widevine(element):
+    return (element.get('schemeIdUri') or '').lower() == _WIDEVINE_URN
+
+
+def _default_kids(elements):
+    return {
+        kid.replace('-', '').lower() for element in elements
+        if (kid := element.get('{urn:mpeg:cenc:2013}default_KID'))}
+
+
+class _RangeReader:
+    _CHUNK_SIZE = 16 << 10
+    _MAX_SKIP = 1 << 20
+
+    def __init__(self, urlopen, url, headers):
+        self._urlopen = urlopen
+        self._url = url
+        self._headers = headers
+        self._response = None
+        self._buffer = b''
+        self._buffer_start = 0
+        self.bytes_read = 0
+
+    def read(self, position, size):
+        buffer_end = self._buffer_start + len(self._buffer)
+
+        if not self._response or not self._buffer_start <= position <= buffer_end + self._MAX_SKIP:
+            self.close()
+            self._response = self._urlopen(Request(
+                self._url, headers={**self._headers, 'Range': f'bytes={position}-'}))
+
+            if position and self._response.status != 206:
+                raise RequestError('Server does not support range requests')
+
+            self._buffer, self._buffer_start = b'', position
+        elif position >= buffer_end:
+            self._skip(position - buffer_end)
+            self._buffer, self._buffer_start = b'', position
+        else:
+            self._buffer = self._buffer[position - self._buffer_start:]
+            self._buffer_start = position
+
+        while len(self._buffer) < size and (chunk := self._read(max(size - len(self._buffer), self._CHUNK_SIZE))):
+            self._buffer += chunk
+
+        return self._buffer[:size]
+
+    def _read(self, size):
+        data = self._response.read(size)
+        self.bytes_read += len(data)
+        return data
+
+    def _skip(self, size):
+        # reads may return less than requested; at the end of the response, the following reads return nothing
+        while size > 0 and (data := self._read(size)):
+            size -= len(data)
+
+    def close(self):
+        if self._response:
+            self._response.close()
+            self._response = None
+
+
+class _LookAheadPagedList(InAdvancePagedList):
+    """InAdvancePagedList which resolves the following pages in the background"""
+
+    def __init__(self, paged_list, look_ahead, prefetch_entry, report_error):
+        super().__init__(paged_list._pagefunc, paged_list._pagecount, paged_list._pagesize)
+        self._cache = paged_list._cache
+        self._look_ahead = -(-look_ahead // self._pagesize)
+        self._prefetch_entry = prefetch_entry
+        self._report_error = report_error
+        self._executor = concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix='mp4decrypt-look-ahead')
+        self._futures = {}
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def getpage(self, pagenum):
+        with self._lock:
+            future = self._futures.pop(pagenum, None)
+
+            if self._executor:
+                for next_pagenum in range(pagenum + 1, min(pagenum + 1 + self._look_ahead, self._pagecount)):
+                    if next_pagenum not in self._futures and next_pagenum not in self._cache:
+                        self._futures[next_pagenum] = self._executor.submit(self._resolve_page, next_pagenum)
+
+                if pagenum + 1 >= self._pagecount:
+                    # nothing is left to look ahead to; pending pages are still resolved
+                    self._executor.shutdown(wait=False)
+                    self._executor = None
+
+        if future is not None:
+            try:
+                self._cache[pagenum] = future.result()
+            except Exception as e:
+                # resolve the page again in the foreground so that errors are handled as usual
+                self._report_error(f'Look-ahead for page {pagenum} failed: {e}')
+
+        return super().getpage(pagenum)
+
+    def close(self):
+        """Stop looking ahead once the playlist is no longer iterated, e.g. after --max-downloads"""
+        with self._lock:
+            self._closed = True
+
+            for future in self._futures.values():
+                future.cancel()
+
+            if self._executor:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+
+    def _resolve_page(self, pagenum):
+        entries = list(self._pagefunc(pagenum))
+
+        for entry in entries:
+            if self._closed:
+                break
+
+            try:
+                self._prefetch_entry(entry)
+            except Exception as e:
+                self._report_error(f'Prefetching keys failed: {e}')
+
+        return entries
+
+
+class _CdmPool:
+    def __init__(self, devicepaths):
+        self._cdms = [Cdm.from_device(Device.load(path)) for path in devicepaths]
+        self._slots = [threading.BoundedSemaphore(Cdm.MAX_NUM_OF_SESSIONS) for _ in self._cdms]
+        self._indices = itertools.cycle(range(len(self._cdms)))
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def session(self):
+        """Open a session on the next device, closing it when done"""
+        with self._lock:
+            index = next(self._indices)
+
+        cdm = self._cdms[index]
+
+        with self._slots[index]:
+            session_id = cdm.open()
+
+            try:
+                yield cdm, session_id
+            finally:
+                cdm.close(session_id)
+
+
+class _KeyCache:
+    """LRU cache of content keys indexed by KID"""
+
+    def __init__(self, maxsize, ttl=None):
+        self._maxsize = maxsize
+        self._ttl = ttl
+        self._keys = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, kids):
+        """Return the key arguments for all kids, or None if any of them is unknown"""
+        keys, now = (), time.monotonic()
+
+        with self._lock:
+            for kid in kids:
+                key, expires = self._keys.get(kid, (None, None))
+
+                if key is None or (expires is not None and expires < now):
+                    self._keys.pop(kid, None)
+                    return None
+
+                self._keys.move_to_end(kid)
+                keys += ('--key', f'{kid}:{key}')
+
+        return keys
+
+    def update(self, keys):
+        expires = time.monotonic() + self._ttl if self._ttl is not None else None
+
+        with self._lock:
+            for keyarg in keys[1::2]:
+                kid, _, key = keyarg.partition(':')
+                self._keys[kid] = key, expires
+                self._keys.move_to_end(kid)
+
+            while len(self._keys) > self._maxsize:
+                self._keys.popitem(last=False)
+
+
+class _DecryptionProgress:
+    """Report the decryption progress of a part through the postprocessor hooks, at most once per interval"""
+    _INTERVAL = 1
+
+    def __init__(self, pp, info, part):
+        self._pp = pp
+        self._info = info
+        self._filename = part['filepath']
+        self._format_id = part.get('format_id')
+        self.total_bytes = os.path.getsize(part['filepath'])
+        self.processed_bytes = 0
+        self._start = time.monotonic()
+        self._last = None
+        self._lock = threading.Lock()
+
+    def update(self, processed_bytes):
+        now = time.monotonic()
+
+        with self._lock:
+            processed_bytes = min(max(processed_bytes, self.processed_bytes), self.total_bytes)
+
+            if self._last is not None and (processed_bytes == self.processed_bytes or (
+                    now - self._last < self._INTERVAL and processed_bytes < self.total_bytes)):
+                return
+
+            self._last, self.processed_bytes = now, processed_bytes
+
+        elapsed = now - self._start
+        speed = processed_bytes / elapsed if processed_bytes and elapsed else None
+        eta = (self.total_bytes - processed_bytes) / speed if speed else None
+        percent = processed_bytes / self.total_bytes * 100 if self.total_bytes else 100
+
+        self._pp._hook_progress({
+            'status': 'processing',
+            'filename': self._filename,
+            'format_id': self._format_id,
+            'processed_bytes': processed_bytes,
+            'total_bytes': self.total_bytes,
+            'elapsed': elapsed,
+            'speed': speed,
+            'eta': eta,
+            '_percent': percent,
+            '_percent_str': FileDownloader.format_percent(percent),
+            '_speed_str': FileDownloader.format_speed(speed).strip(),
+            '_eta_str': FileDownloader.format_eta(eta).strip(),
+        }, self._info)
+
+
 class Mp4DecryptPP(PostProcessor):
     def __init__(self, downloader=None, **kwargs):
-        self._decryptor = Mp4DecryptDecryptor()
-        super().__init__(downloader)
+        self._decryptor = Mp4DecryptDecryptor(**kwargs)
+        self._metrics = self._decryptor._metrics
         self._kwargs = kwargs
+        super().__init__(downloader)
         self._pssh = {}
         self._license_urls = {}
-        self._keys = {}
+        self._default_kids = {}
+        self._pssh_kids = {}
+        self._key_cache = _KeyCache(
+            int(kwargs.get('key_cache_size', 256)),
+            float(kwargs['key_cache_ttl']) if kwargs.get('key_cache_ttl') else None)
+        self._failure_ttl = float(kwargs.get('failure_cache_ttl', 86400))
+        self._cdm_pool = None
+        self._keystore = None
+        self._prefetch_executor = None
+        self._prefetches = {}
+        self._in_flight = {}
+        self._lock = threading.Lock()
 
     def set_downloader(self, downloader):
         _inject_mixin(downloader, Mp4DecryptDownloader, self)
         self._decryptor.set_downloader(downloader)
+
+        if downloader and '_request_director' in downloader.__dict__:
+            self._add_license_handler(downloader, downloader._request_director)
+
         return super().set_downloader(downloader)
 
-    def add_mpd(self, mpd_url, pssh, license_url):
+    def _add_license_handler(self, downloader, director):
+        if 'License' in director.handlers or not (pool_size := int(self._kwargs.get('license_pool_size', 4))):
+            return
+
+        # the handler is created by yt-dlp so that it gets the same options as the default handlers
+        handler = downloader.build_request_director(
+            [functools.partial(LicenseRH, pool_size=pool_size)]).handlers['License']
+        director.add_handler(handler)
+        director.preferences.add(lambda rh, _: 500 if rh == handler and is_license_request() else 0)
+
+    def add_mpd(self, mpd_url, pssh, license_url, default_kids=()):
         if pssh:
             self._pssh[mpd_url] = pssh
+        if default_kids:
+            self._default_kids[mpd_url] = tuple(default_kids)
 
         self._license_urls[mpd_url] = license_url
 
+        if pssh and license_url and self._prefetch_keys_enabled():
+            # the entry may still supply its own license callback, so an empty response is not remembered
+            self._prefetch_keys(mpd_url, pssh, *self._get_license({}, mpd_url))
+
+    def prefetch_info(self, info):
+        """Request the keys of an extracted video whose license is provided by the extractor"""
+        if not self._prefetch_keys_enabled() or not any(key in info for key in ('_license_url', '_license_callback')):
+            return
+
+        for fmt in info.get('formats') or ():
+            if self._is_encrypted(fmt) and (pssh := fmt.get('_mp4decrypt_pssh') or self._pssh.get(fmt['manifest_url'])):
+                license_callback, license_url = self._get_license(info, fmt['manifest_url'])
+                if license_callback:
+                    self._prefetch_keys(fmt['manifest_url'], pssh, license_callback, license_url)
+
+    def _prefetch_keys_enabled(self):
+        return self._kwargs.get('prefetch_keys', '').lower() in ('1', 'true', 'yes')
+
     def run(self, info):
         has_license = any(key in info for key in ('_cenc_key', '_license_url', '_license_callback'))
+        parts = [
+            part for part in info.get('requested_formats', (info,))
+            if (has_license and part.get('protocol') == 'm3u8_native') or self._is_encrypted(part)]
+
+        if not parts:
+            return [], info
+
+        if '__real_download' in info:
+            raise PostProcessingError(f'{self.PP_NAME} must be used with \'when=before_dl\'')
 
-        for part in info.get('requested_formats', (info,)):
-            if (has_license and part.get('protocol') == 'm3u8_native') or self._is_encrypted(part):
-                self._add_keys(info, part)
+        job = info.setdefault('__mp4decrypt_metrics', Metrics())
+
+        def get_keys(part):
+            with job_metrics(job):
+                return self._get_keys(info, part)
+
+        if len(parts) > 1:
+            with concurrent.futures.ThreadPoolExecutor(len(parts)) as executor:
+                all_keys = list(executor.map(get_keys, parts))
+        else:
+            all_keys = [get_keys(part) for part in parts]
+
+        info['mp4decrypt_metrics'] = job.to_dict()
+
+        for part, keys in zip(parts, all_keys):
+            self._add_keys(info, part, keys)
 
         return [], info
 
@@ -61,11 +458,38 @@ class Mp4DecryptPP(PostProcessor):
         return part.get('container') in ('mp4_dash', 'm4a_dash') and \
             part.get('manifest_url') in self._license_urls
 
-    def _add_keys(self, info, part):
-        if '__real_download' in info:
-            raise PostProcessingError(f'{self.PP_NAME} must be used with \'when=before_dl\'')
+    def prefetch_entry(self, info):
+        """Obtain the keys of the formats of an extracted playlist entry which are likely to be downloaded"""
+        if not isinstance(info, dict) or not info.get('formats'):
+            return
+
+        has_license = any(key in info for key in ('_cenc_key', '_license_url', '_license_callback'))
+        seen = set()
+
+        for fmt in self._guess_formats(info):
+            if not ((has_license and fmt.get('protocol') == 'm3u8_native') or self._is_encrypted(fmt)):
+                continue
+
+            if (key := fmt.get('_mp4decrypt_pssh') or fmt.get('manifest_url')) not in seen:
+                seen.add(key)
+                self._get_keys(info, fmt)
+
+    def _guess_formats(self, info):
+        """Return the formats which the format selection would pick, before the entry is processed"""
+        ydl = self._downloader
+        entry = {**info, 'formats': [dict(fmt) for fmt in info['formats']]}
+        ydl.sort_formats(entry)
+        selector = ydl.format_selector
+
+        if not callable(selector):
+            selector = ydl.build_format_selector(ydl._default_format_spec(entry))
+
+        return [
+            part for fmt in ydl._select_formats(entry['formats'], selector)
+            for part in fmt.get('requested_formats') or (fmt,)]
 
-        if keys := self._get_keys(info, part):
+    def _add_keys(self, info, part, keys):
+        if keys:
             part['_mp4decrypt'] = keys
         else:
             raise UnavailableVideoError('No keys found for ' + part['format_id'])
@@ -74,32 +498,71 @@ class Mp4DecryptPP(PostProcessor):
             info.setdefault('__postprocessors', [])
             info['__postprocessors'].append(self._decryptor)
 
+    def _single_flight(self, key, func):
+        """Run func once for concurrent callers with the same key"""
+        with self._lock:
+            if owner := key not in self._in_flight:
+                self._in_flight[key] = concurrent.futures.Future()
+            future = self._in_flight[key]
+
+        if owner:
+            try:
+                future.set_result(func())
+            except BaseException as e:
+                future.set_exception(e)
+            finally:
+                with self._lock:
+                    del self._in_flight[key]
+
+        return future.result()
+
     def _get_keys(self, info, part):
         if keys := info.get('_cenc_key'):
             return tuple([arg for key in variadic(keys, str) for arg in ('--key', key)])
 
-        mpd_url = part['manifest_url']
+        kids = part.get('_mp4decrypt_kids') or self._default_kids.get(part['manifest_url'], ())
 
-        if mpd_url in self._pssh:
-            pssh = self._pssh[mpd_url]
-        else:
-            pssh = self._pssh[mpd_url] = self._pssh_from_init(part)
+        if keys := self._cached_keys_for_kids(kids):
+            self.write_debug('Using cached keys for the default KIDs of ' + part['format_id'])
+            return keys
+
+        pssh = part.get('_mp4decrypt_pssh') \
+            or self._single_flight(('pssh', part['manifest_url']), lambda: self._get_pssh(part))
 
         if not pssh:
             return ()
 
-        if keys := self._keys.get(pssh):
-            return keys
+        if prefetch := self._prefetches.pop(pssh, None):
+            try:
+                prefetch.result()
+            except Exception as e:
+                self.write_debug(f'Prefetching keys for {part["format_id"]} failed: {e}')
+
+        license_callback, license_url = self._get_license(info, part['manifest_url'])
+        keys = self._single_flight(
+            ('keys', pssh), lambda: self._load_keys(pssh, part['manifest_url'], license_callback, license_url))
+        return self._select_keys(keys, part.get('_mp4decrypt_kids'))
+
+    @staticmethod
+    def _select_keys(keys, kids):
+        """Only keep the keys for the given KIDs, unless none of them matches"""
+        selected = tuple(
+            arg for keyarg in keys[1::2] if kids and keyarg.partition(':')[0] in kids for arg in ('--key', keyarg))
+        return selected or keys
+
+    def _get_pssh(self, part):
+        mpd_url = part['manifest_url']
 
-        cache_args = ('mp4decrypt-pssh', hashlib.md5(pssh.encode('ascii')).hexdigest())
+        if mpd_url not in self._pssh:
+            if self._has_failure('pssh', self._init_id(part)):
+                self.report_warning(f'Skipping {part["format_id"]}: no PSSH was found in a previous run')
+                self._pssh[mpd_url] = None
+            else:
+                self._pssh[mpd_url] = self._pssh_from_init(part)
 
-        if (data := self._downloader.cache.load(*cache_args)) \
-                and data['pssh'] == pssh and (keys := data['keys']):
-            for i in range(1, len(keys), 2):
-                self.to_screen(f'Loaded key from cache: {keys[i]}')
-            self._keys[pssh] = keys
-            return keys
+        return self._pssh[mpd_url]
 
+    def _get_license(self, info, mpd_url):
         license_callback = info.get('_license_callback')
         license_urls = info.get('_license_url', self._license_urls.get(mpd_url))
         license_url = license_urls[mpd_url] if isinstance(license_urls, dict) else license_urls
@@ -112,99 +575,497 @@ class Mp4DecryptPP(PostProcessor):
                     license_url, data=challenge,
                     headers={'Content-Type': 'application/octet-stream'})).read()
 
-        if license_callback:
-            return self._fetch_keys(pssh, license_callback, cache_args, mpd_url, license_url)
+        return license_callback, license_url
+
+    def _load_keys(self, pssh, mpd_url, license_callback, license_url, remember_failure=True):
+        kids = self._pssh_kids.get(pssh) or [kid.hex for kid in PSSH(pssh).key_ids]
+
+        if keys := self._count_lookup('memory', self._key_cache.get(kids)):
+            return keys
+
+        if keys := self._count_lookup('disk', self._load_cached_keys(pssh)):
+            for i in range(1, len(keys), 2):
+                self.to_screen(f'Loaded key from cache: {keys[i]}')
+            self._remember_keys(pssh, keys)
+            return keys
+
+        if license_callback and self._has_failure('keys', pssh_hash(pssh)):
+            self.report_warning('Skipping license request: no keys were obtained for this PSSH in a previous run')
+        elif license_callback:
+            return self._fetch_keys(pssh, license_callback, mpd_url, license_url, remember_failure)
 
         return ()
 
+    def _prefetch_keys(self, mpd_url, pssh, license_callback, license_url):
+        """Request keys in the background; failures are not remembered, as they are requested again when needed"""
+        if not self._get_cdm_pool():
+            return
+
+        with self._lock:
+            if pssh in self._prefetches:
+                return
+
+            if self._prefetch_executor is None:
+                self._prefetch_executor = concurrent.futures.ThreadPoolExecutor(
+                    4, thread_name_prefix='mp4decrypt-prefetch')
+
+            self._prefetches[pssh] = self._prefetch_executor.submit(
+                self._single_flight, ('keys', pssh),
+                lambda: self._load_keys(pssh, mpd_url, license_callback, license_url, remember_failure=False))
+
+    @staticmethod
+    def _init_id(part):
+        url = urllib.parse.urlsplit(part['manifest_url'])._replace(query='', fragment='').geturl()
+        return f'{url}#{part["format_id"]}'
+
+    def _has_failure(self, kind, key):
+        if not self._failure_ttl:
+            return False
+
+        if keystore := self._get_keystore():
+            return keystore.has_failure(kind, key)
+
+        data = self._downloader.cache.load('mp4decrypt-failures', f'{kind}-{hashlib.md5(key.encode()).hexdigest()}')
+        return bool(data) and data['expires'] > time.time()
+
+    def _add_failure(self, kind, key):
+        if not self._failure_ttl:
+            return
+
+        expires = time.time() + self._failure_ttl
+
+        if keystore := self._get_keystore():
+            keystore.add_failure(kind, key, expires)
+        else:
+            self._downloader.cache.store(
+                'mp4decrypt-failures', f'{kind}-{hashlib.md5(key.encode()).hexdigest()}', {'expires': expires})
+
     def _pssh_from_init(self, part):
-        def find_wv_pssh_offsets(raw):
-            offset = 0
+        start = time.monotonic()
+
+        try:
+            data, complete = self._probe_pssh(part)
+        except (RequestError, OSError, KeyError, ValueError) as e:
+            self.write_debug(f'Unable to probe init segment of {part["format_id"]}: {e}')
+            data = None
+
+        if data is None:
+            data = self._download_init(part) or None
+            record(self._metrics, 'init_probe_bytes', len(data or b''))
+            complete = None
+
+        record(self._metrics, 'init_probes')
+        record(self._metrics, 'init_probe_seconds', time.monotonic() - start)
+
+        if data is not None:
+            try:
+                for pssh in iter_pssh(data):
+                    if pssh.system_id == PSSH.SystemId.Widevine.bytes:
+                        self.to_screen('Extracted PSSH from init segment')
+                        return PSSH(bytes(data[pssh.offset:pssh.end])).dumps()
+
+                if complete is None:
+                    complete = next((box[0] for box in iter_boxes(data) if box[0] in (b'moov', b'moof')), None) == b'moov'
+
+                # truncated or unexpected init segments may still have a PSSH on the next attempt
+                if complete:
+                    self._add_failure('pssh', self._init_id(part))
+            except UnsupportedError as e:
+                self.write_debug(f'Unable to parse init segment of {part["format_id"]}: {e}')
+
+        self.report_warning('Could not find PSSH for ' + part['format_id'])
+        return None
 
-            while (offset := raw.find(b'pssh', offset)) != -1:
-                pssh_offset = offset - 4
-                size = int.from_bytes(raw[pssh_offset:offset], byteorder='big')
-                offset += size
-                yield PSSH(raw[pssh_offset:pssh_offset + size])
+    def _probe_pssh(self, part):
+        headers = part.get('http_headers') or {}
+        extra_query = urllib.parse.parse_qs(part.get('extra_param_to_segment_url') or '')
+        start, end = 0, None
+
+        if part.get('protocol') == 'm3u8_native':
+            playlist = self._downloader.urlopen(Request(part['url'], headers=headers)).read().decode()
+            pssh_boxes = b''
+
+            for key in re.findall(r'#EXT-X-KEY:(.+)', playlist):
+                key = parse_m3u8_attributes(key)
+                if key.get('KEYFORMAT', '').lower() == PSSH.SystemId.Widevine.urn and \
+                        key.get('URI', '').startswith('data:'):
+                    pssh_boxes += base64.b64decode(key['URI'].partition(',')[2])
+
+            if pssh_boxes:
+                return pssh_boxes, False
+
+            if not (init := re.search(r'#EXT-X-MAP:(.+)', playlist)):
+                return None, False
+
+            init = parse_m3u8_attributes(init.group(1))
+            url = urljoin(part['url'], init['URI'])
+
+            if byte_range := init.get('BYTERANGE'):
+                length, _, start = byte_range.partition('@')
+                start = int(start or 0)
+                end = start + int(length)
+        elif isinstance(fragments := part.get('fragments'), list) and fragments:
+            url = fragments[0].get('url') or urljoin(part.get('fragment_base_url'), fragments[0]['path'])
+        else:
+            url, extra_query = part['url'], None
 
+        if extra_query:
+            url = update_url_query(url, extra_query)
+
+        reader = _RangeReader(self._downloader.urlopen, url, headers)
+        pssh_boxes = []
+
+        try:
+            complete = self._read_pssh_boxes(reader, start, end, pssh_boxes)
+            return b''.join(pssh_boxes), complete
+        finally:
+            self.write_debug(f'Probed {reader.bytes_read} bytes of init segment for {part["format_id"]}')
+            record(self._metrics, 'init_probe_bytes', reader.bytes_read)
+            reader.close()
+
+    def _read_pssh_boxes(self, reader, position, end, pssh_boxes, top_level=True):
+        """Collect the PSSH boxes; returns whether all the boxes of a moov have been read"""
+        while end is None or position + 8 <= end:
+            header = reader.read(position, 16)
+
+            if len(header) < 8:
+                return False
+
+            size, box_type = struct.unpack_from('>I4s', header)
+            header_size = 8
+
+            if size == 1:
+                size, header_size = struct.unpack_from('>Q', header, 8)[0], 16
+            elif size < header_size:
+                return False
+
+            if box_type in (b'moov', b'moof'):
+                # PSSH boxes are only found at this level
+                complete = self._read_pssh_boxes(reader, position + header_size, position + size, pssh_boxes, False)
+                return complete and box_type == b'moov'
+            elif box_type == b'pssh':
+                pssh = reader.read(position, size)
+
+                if len(pssh) < size:
+                    return False
+
+                pssh_boxes.append(pssh)
+
+                if pssh[12:28] == PSSH.SystemId.Widevine.bytes:
+                    return True
+            elif top_level and not re.fullmatch(rb'[\x20-\x7e]{4}', box_type):
+                raise ValueError('Init segment is not an MP4 file')
+
+            position += size
+
+        return not top_level and position == end
+
+    def _download_init(self, part):
         init_data = b''
         temp_file = tempfile.NamedTemporaryFile(suffix='.tmp', delete=False)
         temp_file.close()
-        success, _ = self._downloader.dl(temp_file.name, part, test=True)
 
-        if success:
-            with open(temp_file.name, 'rb') as f:
-                init_data = f.read()
-            os.remove(temp_file.name)
+        try:
+            success, _ = self._downloader.dl(temp_file.name, part, test=True)
 
-        for pssh in find_wv_pssh_offsets(init_data):
-            if pssh.system_id == PSSH.SystemId.Widevine:
-                self.to_screen('Extracted PSSH from init segment')
-                return pssh.dumps()
+            if success:
+                with open(temp_file.name, 'rb') as f:
+                    init_data = f.read()
+        finally:
+            if os.path.exists(temp_file.name):
+                os.remove(temp_file.name)
 
-        self.report_warning('Could not find PSSH for ' + part['format_id'])
-        return None
+        return init_data
 
-    def _fetch_keys(self, pssh, callback, cache_args, mpd_url, license_url=None):
+    def _fetch_keys(self, pssh, callback, mpd_url, license_url=None, remember_failure=True):
         keys = ()
 
-        if devicepath := self._kwargs.get('devicepath'):
-            cdm = Cdm.from_device(Device.load(devicepath))
-            session_id = cdm.open()
-            challenge = cdm.get_license_challenge(session_id, PSSH(pssh), 'STREAMING', privacy_mode=True)
-            license_msg = callback(challenge, license_url) if license_url else callback(challenge)
-            cdm.parse_license(session_id, license_msg)
-
-            for key in cdm.get_keys(session_id):
-                if key.type == 'CONTENT':
-                    keyarg = f'{key.kid.hex}:{key.key.hex()}'
-                    self.to_screen(f'Fetched key: {keyarg}')
-                    keys += ('--key', keyarg)
-
-        self._keys[pssh] = keys
-        self._downloader.cache.store(*cache_args, {'pssh': pssh, 'keys': keys})
+        if cdm_pool := self._get_cdm_pool():
+            with cdm_pool.session() as (cdm, session_id):
+                challenge = cdm.get_license_challenge(session_id, PSSH(pssh), 'STREAMING', privacy_mode=True)
+
+                with license_requests():
+                    start = time.monotonic()
+                    license_msg = callback(challenge, license_url) if license_url else callback(challenge)
+
+                host = (license_url and urllib.parse.urlsplit(license_url).hostname) or 'callback'
+                record(self._metrics, 'license_requests', label=host)
+                record(self._metrics, 'license_seconds', time.monotonic() - start, host)
+
+                cdm.parse_license(session_id, license_msg)
+
+                for key in cdm.get_keys(session_id):
+                    if key.type == 'CONTENT':
+                        keyarg = f'{key.kid.hex}:{key.key.hex()}'
+                        self.to_screen(f'Fetched key: {keyarg}')
+                        keys += ('--key', keyarg)
+
+        self._remember_keys(pssh, keys)
+        self._store_cached_keys(pssh, keys)
+
+        if cdm_pool and not keys and remember_failure:
+            self._add_failure('keys', pssh_hash(pssh))
+
         return keys
 
+    def _remember_keys(self, pssh, keys):
+        self._pssh_kids[pssh] = [keyarg.partition(':')[0] for keyarg in keys[1::2]]
+        self._key_cache.update(keys)
+
+    def _cached_keys_for_kids(self, kids):
+        if not kids:
+            return None
+
+        if keys := self._count_lookup('memory', self._key_cache.get(kids)):
+            return keys
+
+        if (keystore := self._get_keystore()) and (keys := self._count_lookup('disk', keystore.get_keys(kids))):
+            self._key_cache.update(keys)
+            return keys
+
+        return None
+
+    def _count_lookup(self, cache, keys):
+        record(self._metrics, 'key_cache_hits' if keys else 'key_cache_misses', label=cache)
+        return keys
+
+    def _load_cached_keys(self, pssh):
+        if keystore := self._get_keystore():
+            return keystore.load(pssh)
+
+        data = self._downloader.cache.load('mp4decrypt-pssh', pssh_hash(pssh))
+        return data and data['pssh'] == pssh and data['keys']
+
+    def _store_cached_keys(self, pssh, keys):
+        if keystore := self._get_keystore():
+            keystore.store(pssh, keys)
+        else:
+            self._downloader.cache.store('mp4decrypt-pssh', pssh_hash(pssh), {'pssh': pssh, 'keys': keys})
+
+    def _get_keystore(self):
+        with self._lock:
+            if self._keystore is None and (path := self._kwargs.get('keystore')):
+                keystore = KeyStore(expand_path(path))
+
+                if count := keystore.migrate(self._downloader.cache):
+                    self.to_screen(f'Imported {count} cached PSSH entries into keystore')
+
+                self._keystore = keystore
+
+        return self._keystore
+
+    def _get_cdm_pool(self):
+        with self._lock:
+            if self._cdm_pool is None and (devicepath := self._kwargs.get('devicepath')):
+                self._cdm_pool = _CdmPool([path.strip() for path in devicepath.split(',') if path.strip()])
+
+        return self._cdm_pool
+
 
 class Mp4DecryptDownloader:
+    def build_request_director(self, handlers, preferences=None):
+        director = self._mixin_class.build_request_director(self, handlers, preferences)
+        self._mixin_pp._add_license_handler(self, director)
+        return director
+
     def add_info_extractor(self, ie):
         _inject_mixin(ie, Mp4DecryptExtractor, self._mixin_pp)
         return self._mixin_class.add_info_extractor(self, ie)
 
+    def process_ie_result(self, ie_result, *args, **kwargs):
+        # the entries are replaced by the processed ones
+        entries = ie_result.get('entries')
+
+        try:
+            return self._mixin_class.process_ie_result(self, ie_result, *args, **kwargs)
+        finally:
+            if isinstance(entries, _LookAheadPagedList):
+                entries.close()
+
+    def dl(self, name, info, subtitle=False, test=False):
+        if test or not info.get('url') or self._mixin_pp._kwargs.get('mode') != 'stream' or not any(
+                '_mp4decrypt' in part for part in info.get('requested_formats', (info,))):
+            return self._mixin_class.dl(self, name, info, subtitle, test)
+
+        fd_class = get_suitable_downloader(info, self.params, to_stdout=(name == '-'))
+
+        if not issubclass(fd_class, FragmentFD):
+            return self._mixin_class.dl(self, name, info, subtitle, test)
+
+        fd = fd_class(self, self.params)
+        _inject_mixin(fd, Mp4DecryptFragmentDownloader, self._mixin_pp)
+
+        for ph in self._progress_hooks:
+            fd.add_progress_hook(ph)
+        urls = '", "'.join(f['url'] for f in info.get('requested_formats', []) or [info])
+        self.write_debug(f'Invoking {fd.FD_NAME} downloader on "{urls}"')
+
+        new_info = self._copy_infodict(info)
+        if new_info.get('http_headers') is None:
+            new_info['http_headers'] = self._calc_headers(new_info)
+
+        return fd.download(name, new_info, subtitle)
+
+
+class Mp4DecryptFragmentDownloader:
+    # the decrypted init segment replaces the written original one once a media fragment has been decrypted
+    _mp4decrypt_held_init = None
+
+    def _prepare_and_start_frag_download(self, ctx, info_dict):
+        self._prepare_frag_download(ctx)
+
+        if '_mp4decrypt' in info_dict and ctx['fragment_index'] and not self._mp4decrypt_can_resume(ctx, info_dict):
+            self.report_warning('Fragments were not decrypted while downloading. Restarting from the beginning ...')
+            ctx['dest_stream'].seek(0)
+            ctx['dest_stream'].truncate()
+            ctx['fragment_index'] = ctx['complete_frags_downloaded_bytes'] = 0
+            ctx.pop('extra_state', None)
+            self._write_ytdl_file(ctx)
+
+        self._start_frag_download(ctx, info_dict)
+
+    def _mp4decrypt_can_resume(self, ctx, info_dict):
+        # the written fragments must all have been decrypted, as the rest of them will be
+        if not ctx.get('extra_state', {}).get('mp4decrypt_stream'):
+            return False
+
+        try:
+            if init := read_init(ctx['tmpfilename']):
+                CencDecrypter(parse_keys(info_dict['_mp4decrypt'])).decrypt(bytearray(init))
+        except UnsupportedError:
+            return False
+
+        return True
+
+    def download_and_append_fragments(self, ctx, fragments, info_dict, *args, **kwargs):
+        self._mp4decrypt_held_init = None
+
+        if '_mp4decrypt' in info_dict:
+            # a pipe cannot be rewritten
+            info_dict = {
+                **info_dict,
+                '_mp4decrypt_hold_init': ctx['tmpfilename'] != '-',
+                # saved with the fragment index, so that a resumed download does not mix decrypted fragments in
+                '_mp4decrypt_state': ctx.setdefault('extra_state', {}),
+            }
+            info_dict['_mp4decrypt_state']['mp4decrypt_stream'] = True
+
+            if ctx.get('complete_frags_downloaded_bytes'):
+                # resumed download: track information is recovered from the already written init segment
+                info_dict['_mp4decrypt_init'] = read_init(ctx['tmpfilename'])
+
+        return self._mixin_class.download_and_append_fragments(self, ctx, fragments, info_dict, *args, **kwargs)
+
+    def _append_fragment(self, ctx, frag_content):
+        if held := self._mp4decrypt_held_init:
+            if held['offset'] is None:
+                held['offset'] = ctx['dest_stream'].tell()
+            elif held['ready']:
+                self._mp4decrypt_held_init = None
+                ctx['dest_stream'].flush()
+
+                with open(ctx['tmpfilename'], 'r+b') as f:
+                    f.seek(held['offset'])
+                    f.write(held['data'])
+
+        return self._mixin_class._append_fragment(self, ctx, frag_content)
+
+    def decrypter(self, info_dict):
+        decrypt_fragment = self._mixin_class.decrypter(self, info_dict)
+
+        if '_mp4decrypt' not in info_dict:
+            return decrypt_fragment
+
+        try:
+            cenc = CencDecrypter(parse_keys(info_dict['_mp4decrypt']))
+            if init := info_dict.get('_mp4decrypt_init'):
+                cenc.decrypt(data := bytearray(init))
+        except UnsupportedError as e:
+            self.report_warning(f'Fragments cannot be decrypted while downloading ({e})')
+            info_dict['_mp4decrypt_state']['mp4decrypt_stream'] = False
+            return decrypt_fragment
+
+        started = bool(init)
+        if init and data != init:
+            # interrupted before the held init segment could be written
+            self._mp4decrypt_held_init = {'offset': 0, 'data': data, 'ready': False}
+            started = False
+
+        def cenc_decrypt_fragment(fragment, frag_content):
+            nonlocal cenc, started
+            frag_content = decrypt_fragment(fragment, frag_content)
+
+            if not frag_content or not cenc:
+                return frag_content
+
+            data = bytearray(frag_content)
+
+            try:
+                cenc.decrypt(data)
+            except UnsupportedError as e:
+                if started:
+                    raise DownloadError(f'Unable to decrypt fragment {fragment["frag_index"]}: {e}')
+
+                # the original init segment is kept, so that the file is decrypted after the download
+                self.report_warning(f'Fragments cannot be decrypted while downloading ({e})')
+                info_dict['_mp4decrypt_state']['mp4decrypt_stream'] = False
+                cenc = self._mp4decrypt_held_init = None
+                return frag_content
+
+            if not started and info_dict['_mp4decrypt_hold_init'] and not any(
+                    box[0] == b'moof' for box in iter_boxes(data)):
+                self._mp4decrypt_held_init = {'offset': None, 'data': data, 'ready': False}
+                return frag_content
+
+            if self._mp4decrypt_held_init:
+                self._mp4decrypt_held_init['ready'] = True
+
+            started = True
+            return data
+
+        return cenc_decrypt_fragment
+
 
 class Mp4DecryptExtractor:
+    def extract(self, url):
+        ie_result = self._mixin_class.extract(self, url)
+        look_ahead = int(self._mixin_pp._kwargs.get('prefetch', 0))
+
+        if look_ahead > 0 and not self.get_param('lazy_playlist'):
+            # otherwise the whole playlist is resolved before the first entry is downloaded
+            self._mixin_pp.report_warning('prefetch is ignored without --lazy-playlist', only_once=True)
+            look_ahead = 0
+
+        if look_ahead > 0 and isinstance(ie_result, dict) \
+                and isinstance(ie_result.get('entries'), InAdvancePagedList):
+            ie_result['entries'] = _LookAheadPagedList(
+                ie_result['entries'], look_ahead, self._mixin_pp.prefetch_entry, self.write_debug)
+
+        if isinstance(ie_result, dict) and ie_result.get('formats'):
+            self._mixin_pp.prefetch_info(ie_result)
+
+        return ie_result
+
     def _parse_mpd_periods(self, mpd_doc, *args, **kwargs):
-        elements = mpd_doc.findall('.//{*}ContentProtection')
-        found = False
-
-        for element in elements:
-            if element.get('schemeIdUri').lower() == PSSH.SystemId.Widevine.urn:
-                self._mixin_pp.add_mpd(
-                    kwargs.get('mpd_url') or args[2],
-                    element.findtext('./{*}pssh'),
-                    element.get('{urn:brightcove:2015}licenseAcquisitionUrl'),
-                )
-                found = True
-
-        if elements and found:
-            # treat formats as unprotected
-            for parent in mpd_doc.findall('.//*/..[{*}ContentProtection]'):
-                for child in parent.findall('{*}ContentProtection'):
-                    parent.remove(child)
-
-        roles = {}
-
-        for adaptation_set in mpd_doc.findall('.//{*}AdaptationSet'):
-            if adaptation_set.get('mimeType') != 'audio/mp4' and \
-                    adaptation_set.get('contentType') != 'audio':
-                continue
-            if (role := adaptation_set.find('{*}Role')) is not None:
-                for representation in adaptation_set.findall('{*}Representation[@id]'):
-                    roles[representation.get('id')] = role.get('value')
+        widevine, default_kids, roles, representation_protection = _scan_mpd(mpd_doc)
+        mpd_id = kwargs['mpd_id'] if 'mpd_id' in kwargs else args[0] if args else None
+
+        for element in widevine:
+            self._mixin_pp.add_mpd(
+                kwargs.get('mpd_url') or args[2],
+                element.findtext('./{*}pssh'),
+                element.get('{urn:brightcove:2015}licenseAcquisitionUrl'),
+                sorted(default_kids),
+            )
 
         for period_entry in self._mixin_class._parse_mpd_periods(self, mpd_doc, *args, **kwargs):
             for fmt in period_entry['formats']:
-                if role := roles.get(fmt['format_id']):
+                representation_id = remove_start(fmt['format_id'], f'{mpd_id}-') if mpd_id else fmt['format_id']
+
+                if widevine and (fmt_protection := representation_protection.get(representation_id)):
+                    fmt['_mp4decrypt_pssh'], fmt['_mp4decrypt_kids'] = fmt_protection
+
+                if role := roles.get(representation_id):
                     fmt['format_note'] += f' ({role})'
                     if role in ('description', 'alternate'):
                         fmt['preference'] = -2
@@ -264,31 +1125,187 @@ class Mp4DecryptExtractor:
 
 
 class Mp4DecryptDecryptor(PostProcessor):
+    def __init__(self, downloader=None, **kwargs):
+        super().__init__(downloader)
+        self._kwargs = kwargs
+        self._lock = threading.Lock()
+        self._processes = set()
+        self._cancelled = threading.Event()
+        self._metrics = Metrics()
+        self._metrics_writer = None
+
+        if path := kwargs.get('metrics'):
+            if (metrics_format := kwargs.get('metrics_format', 'json')) not in ('json', 'prometheus'):
+                raise PostProcessingError(f'Unknown metrics format: {metrics_format}')
+            self._metrics_writer = MetricsWriter(expand_path(path), metrics_format)
+
     def run(self, info):
-        to_delete, encrypted = [], []
+        encrypted, deferred = [], False
 
         if 'requested_formats' in info:
             encrypted = [p for p in info['requested_formats'] if self._is_encrypted(p)]
         elif info.get('__real_download') and self._is_encrypted(info):
             encrypted.append(info)
 
-        if encrypted:
-            self.to_screen('[Mp4Decrypt] Decrypting format(s)', prefix=False)
-            for part in encrypted:
-                self._decrypt_part(info, part, to_delete)
-                del part['_mp4decrypt']
+        with job_metrics(info.setdefault('__mp4decrypt_metrics', Metrics())):
+            if encrypted and self._kwargs.get('mode') == 'ffmpeg':
+                remaining = self._defer_to_merger(info, encrypted)
+                deferred, encrypted = len(remaining) < len(encrypted), remaining
+
+            to_delete = self._decrypt(info, encrypted) if encrypted else []
+
+        # the merger writes the metrics once it has decrypted the other formats
+        if not deferred:
+            self._write_metrics(info)
 
         return to_delete, info
 
+    def _write_metrics(self, info):
+        job = info['__mp4decrypt_metrics']
+        info['mp4decrypt_metrics'] = job.to_dict()
+
+        if self._metrics_writer:
+            try:
+                self._metrics_writer.write(self._metrics, job, info)
+            except OSError as e:
+                self.report_warning(f'Unable to write metrics: {e}')
+
     def _is_encrypted(self, info):
         return 'filepath' in info and '_mp4decrypt' in info
 
-    def _decrypt_part(self, info, part, to_delete):
+    def _decrypt(self, info, parts):
+        to_delete = []
+        self.to_screen('[Mp4Decrypt] Decrypting format(s)', prefix=False)
+
+        for part, tmppath in zip(parts, self._decrypt_parts(info, parts)):
+            self._replace_part(info, part, tmppath, to_delete)
+            del part['_mp4decrypt']
+
+        return to_delete
+
+    def _defer_to_merger(self, info, parts):
+        """Leave the decryption of the parts that ffmpeg can decrypt to the merger; returns the other parts"""
+        merger = next((pp for pp in info.get('__postprocessors', ()) if isinstance(pp, FFmpegMergerPP)), None)
+
+        if not merger or not info.get('__files_to_merge'):
+            return parts
+
+        remaining = []
+
+        for part in parts:
+            if part['filepath'] in info['__files_to_merge'] and (key := self._ffmpeg_key(part)):
+                part['_mp4decrypt_ffmpeg_key'] = key
+            else:
+                remaining.append(part)
+
+        if len(remaining) < len(parts):
+            _inject_mixin(merger, Mp4DecryptMerger, self)
+
+        return remaining
+
+    def _ffmpeg_key(self, part):
+        """Return the key with which ffmpeg can decrypt a part, or None"""
+        try:
+            schemes, kids = read_protection(part['filepath'])
+            keys = parse_keys(part['_mp4decrypt'])
+        except UnsupportedError:
+            return None
+
+        # ffmpeg only accepts a single key per input
+        if schemes == {b'cenc'} and len(kids) == 1 and (key := keys.get(next(iter(kids)))):
+            return key.hex()
+
+        return None
+
+    def _decrypt_parts(self, info, parts):
+        workers = min(int(self._kwargs.get('workers', 4)), len(parts))
+        job = current_job()
+        info = self._copy_infodict(info)
+        self._cancelled.clear()
+
+        if workers <= 1:
+            return [self._decrypt_part(part, info) for part in parts]
+
+        def decrypt_part(part):
+            with job_metrics(job):
+                return self._decrypt_part(part, info)
+
+        with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+            futures = [executor.submit(decrypt_part, part) for part in parts]
+
+            try:
+                concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_EXCEPTION)
+            except BaseException:
+                self._cancel(futures)
+                raise
+
+            if failed := next((future for future in futures if future.done() and future.exception()), None):
+                self._cancel(futures)
+                raise failed.exception()
+
+            return [future.result() for future in futures]
+
+    def _cancel(self, futures):
+        self._cancelled.set()
+
+        for future in futures:
+            future.cancel()
+
+        with self._lock:
+            for proc in self._processes:
+                proc.kill()
+
+    def _decrypt_part(self, part, info):
         filepath = part['filepath']
         tmppath = prepend_extension(filepath, 'decrypted')
+        progress = _DecryptionProgress(self, info, part)
+
+        if self._kwargs.get('mode') == 'stream' and not self._is_protected(filepath):
+            # already decrypted while downloading
+            return None
+
+        start = time.monotonic()
+
+        if self._kwargs.get('inplace', '').lower() in ('1', 'true', 'yes') and \
+                self._decrypt_inplace(filepath, part['_mp4decrypt'], progress):
+            progress.update(progress.total_bytes)
+            self._record_decryption(part, start, filepath)
+            return None
+
+        if os.path.exists(tmppath):
+            if self._is_complete(filepath, tmppath):
+                return tmppath
+
+            self.report_warning(f'{tmppath} is incomplete; decrypting it again')
+            os.remove(tmppath)
+
+        # an interrupted decryption leaves a .part file, which the native engine resumes
+        partpath = tmppath + '.part'
+        self._decrypt_file(filepath, partpath, part['_mp4decrypt'], progress)
+        os.replace(partpath, tmppath)
+        progress.update(progress.total_bytes)
+        self._record_decryption(part, start, tmppath)
+
+        return tmppath
+
+    def _record_decryption(self, part, start, outpath):
+        format_id = part.get('format_id')
+        record(self._metrics, 'decrypted_parts', label=format_id)
+        record(self._metrics, 'decrypt_seconds', time.monotonic() - start, format_id)
+        record(self._metrics, 'decrypt_bytes', os.path.getsize(part['filepath']), format_id)
+        record(self._metrics, 'bytes_written', os.path.getsize(outpath), format_id)
+
+    def _is_complete(self, filepath, tmppath):
+        try:
+            return count_fragments(tmppath) == count_fragments(filepath) and not is_protected(tmppath)
+        except UnsupportedError:
+            return False
+
+    def _replace_part(self, info, part, tmppath, to_delete):
+        filepath = part['filepath']
 
-        if not os.path.exists(tmppath):
-            self._run_mp4decrypt(filepath, tmppath, part['_mp4decrypt'])
+        if tmppath is None:
+            return
 
         if filepath in info.get('__files_to_merge', []):
             idx = info['__files_to_merge'].index(filepath)
@@ -297,7 +1314,78 @@ class Mp4DecryptDecryptor(PostProcessor):
         else:
             os.replace(tmppath, filepath)
 
-    def _run_mp4decrypt(self, filepath, tmppath, keys):
+    def _is_protected(self, filepath):
+        try:
+            return is_protected(filepath)
+        except UnsupportedError:
+            return True
+
+    def _decrypt_file(self, filepath, tmppath, keys, progress=None):
+        engine = self._kwargs.get('engine', 'mp4decrypt')
+
+        if engine == 'native':
+            try:
+                return self._run_native(filepath, tmppath, keys, progress)
+            except UnsupportedError as e:
+                self.report_warning(f'Native decryption is not possible ({e}); falling back to mp4decrypt')
+        elif engine != 'mp4decrypt':
+            raise PostProcessingError(f'Unknown decryption engine: {engine}')
+
+        self._run_mp4decrypt(filepath, tmppath, keys, progress)
+
+    def _decrypt_inplace(self, filepath, keys, progress=None):
+        """Decrypt a file with the native engine where it lies; returns False if it is not possible"""
+        journal_path = filepath + '.journal'
+
+        if not os.path.exists(journal_path) and not self._is_protected(filepath):
+            return True
+
+        try:
+            decrypt_file_inplace(
+                filepath, parse_keys(keys), journal_path, functools.partial(self._report_progress, progress))
+        except UnsupportedError as e:
+            if os.path.exists(journal_path):
+                raise PostProcessingError(f'Unable to decrypt {filepath} in place: {e}')
+
+            self.report_warning(f'In-place decryption is not possible ({e}); decrypting to a new file')
+            return False
+
+        return True
+
+    def _report_progress(self, progress, processed_bytes, _):
+        """Progress callback of the native engine, which also stops cancelled decryptions"""
+        if self._cancelled.is_set():
+            raise PostProcessingError('Decryption cancelled')
+
+        if progress:
+            progress.update(processed_bytes)
+
+    def _run_native(self, filepath, tmppath, keys, progress=None):
+        keys = parse_keys(keys)
+        callback = functools.partial(self._report_progress, progress)
+        processes = int(self._kwargs.get('processes', 1))
+        journal_path = tmppath + '.journal'
+
+        try:
+            if processes > 1:
+                # fragments are written out of order, so the progress cannot be resumed
+                if os.path.exists(journal_path):
+                    os.remove(journal_path)
+
+                try:
+                    return decrypt_file_parallel(filepath, tmppath, keys, processes, callback)
+                except concurrent.futures.BrokenExecutor as e:
+                    self.report_warning(f'Unable to decrypt in parallel ({e}); decrypting in a single process')
+
+            decrypt_file(filepath, tmppath, keys, callback, journal_path)
+        except BaseException as e:
+            if isinstance(e, UnsupportedError) or not os.path.exists(journal_path):
+                for path in (tmppath, journal_path):
+                    if os.path.exists(path):
+                        os.remove(path)
+            raise
+
+    def _run_mp4decrypt(self, filepath, tmppath, keys, progress=None):
         cwd = os.path.dirname(filepath)
         filename = os.path.basename(filepath)
         tmpname = os.path.basename(tmppath)
@@ -315,13 +1403,102 @@ class Mp4DecryptDecryptor(PostProcessor):
                 renames[safe_tmpname] = tmpname
                 tmpname = safe_tmpname
 
-        cmd = ('mp4decrypt', *keys, filename, tmpname)
-        _, stderr, returncode = Popen.run(
-            cmd, cwd=cwd or None, text=True,
-            stdout=subprocess.PIPE, stderr=subprocess.PIPE, stdin=subprocess.PIPE)
-
-        if returncode != 0:
-            raise PostProcessingError(stderr)
+        cmd = ('mp4decrypt', *(('--show-progress',) if progress else ()), *keys, filename, tmpname)
+
+        with Popen(
+                cmd, cwd=cwd or None, text=True,
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE, stdin=subprocess.PIPE) as proc:
+            with self._lock:
+                self._processes.add(proc)
+            try:
+                if progress:
+                    stderr = self._wait_with_progress(proc, os.path.join(cwd, tmpname), progress)
+                else:
+                    _, stderr = proc.communicate_or_kill()
+            finally:
+                with self._lock:
+                    self._processes.discard(proc)
+
+        if proc.returncode != 0:
+            if os.path.exists(tmppath := os.path.join(cwd, tmpname)):
+                os.remove(tmppath)
+            raise PostProcessingError('Decryption cancelled' if self._cancelled.is_set() else stderr)
 
         for from_name, to_name in renames.items():
             os.replace(os.path.join(cwd, from_name), os.path.join(cwd, to_name))
+
+    @staticmethod
+    def _wait_with_progress(proc, tmppath, progress):
+        """Wait for mp4decrypt while reporting its progress; returns its error output"""
+        stderr, parsed = [], [0]
+
+        def read_progress():
+            # each fragment is reported as '\r<done>/<count>', which is read as a line
+            for line in proc.stdout:
+                if (mobj := re.fullmatch(r'(\d+)/(\d+)', line.strip())) and int(mobj.group(2)):
+                    parsed[0] = progress.total_bytes * int(mobj.group(1)) // int(mobj.group(2))
+
+        readers = [
+            threading.Thread(target=read_progress, daemon=True),
+            threading.Thread(target=lambda: stderr.append(proc.stderr.read()), daemon=True)]
+
+        try:
+            for reader in readers:
+                reader.start()
+
+            while True:
+                try:
+                    proc.wait(_DecryptionProgress._INTERVAL)
+                    break
+                except subprocess.TimeoutExpired:
+                    pass
+
+                # the progress output is buffered, so the size of the output is used until it arrives
+                size = 0
+                with contextlib.suppress(OSError):
+                    size = os.path.getsize(tmppath)
+                progress.update(max(parsed[0], size))
+
+            for reader in readers:
+                reader.join()
+        except BaseException:
+            proc.kill()
+            proc.wait()
+            raise
+
+        return ''.join(stderr)
+
+
+class Mp4DecryptMerger:
+    def run(self, info):
+        parts = [fmt for fmt in info['requested_formats'] if '_mp4decrypt_ffmpeg_key' in fmt]
+        self._decryption_keys = {part['filepath']: part.pop('_mp4decrypt_ffmpeg_key') for part in parts}
+        start = time.monotonic()
+
+        with job_metrics(info.setdefault('__mp4decrypt_metrics', Metrics())):
+            try:
+                files_to_delete, info = self._mixin_class.run(self, info)
+            except FFmpegPostProcessorError as e:
+                if not self._decryption_keys:
+                    raise
+
+                self.report_warning(f'Unable to decrypt while merging ({e}); decrypting the formats first')
+                self._decryption_keys = {}
+                files_to_delete = self._mixin_pp._decrypt(info, parts)
+                files_to_delete += self._mixin_class.run(self, info)[0]
+            else:
+                for part in parts:
+                    del part['_mp4decrypt']
+
+            record(self._mixin_pp._metrics, 'merge_seconds', time.monotonic() - start)
+
+        self._mixin_pp._write_metrics(info)
+        return files_to_delete, info
+
+    def real_run_ffmpeg(self, input_path_opts, output_path_opts, **kwargs):
+        decryption_keys = getattr(self, '_decryption_keys', {})
+        input_path_opts = [
+            (path, ['-decryption_key', decryption_keys[path], *opts] if path in decryption_keys else opts)
+            for path, opts in input_path_opts]
+
+        return self._mixin_class.real_run_ffmpeg(self, input_path_opts, output_path_opts, **kwargs)